@@ -0,0 +1,171 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.image import AxesImage
+from matplotlib.figure import Figure
+import hashlib
+import numpy
+import copy
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "BackgroundLayer"
+
+# graticule used by all the plots
+parallels = range(0, 90, 5)
+meridians = range(-90, 90, 5)
+
+# rasterized layers already built by this process
+backgrounds = {}
+
+
+###############################################
+#
+# background rendering
+#
+###############################################
+
+# determine the size in pixels of the raster fitting a box of the given
+# size, keeping the aspect ratio of the map extent
+def raster_size(bmap, width, height):
+    aspect = (bmap.ymax - bmap.ymin) / (bmap.xmax - bmap.xmin)
+    if width * aspect > height:
+        width = height / aspect
+    return max(int(round(width)), 1), max(int(round(width * aspect)), 1)
+
+
+# rasterize coastlines, land fill and graticule lines on a transparent
+# RGBA image covering exactly the map extent
+def render_background(bmap, width, height, dpi, coastlineWidth, landColor, gridWidth):
+
+    # offscreen figure with a single full-size axis
+    fig = Figure(figsize=(width / dpi, height / dpi), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    fig.patch.set_alpha(0)
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.axis('off')
+
+    # draw the static layers
+    layer = copy.copy(bmap)
+    layer.ax = ax
+    layer.drawcoastlines(linewidth=coastlineWidth)
+    layer.fillcontinents(color=landColor)
+    if gridWidth:
+        layer.drawparallels(parallels, linewidth=gridWidth)
+        layer.drawmeridians(meridians, linewidth=gridWidth)
+    ax.set_xlim(bmap.xmin, bmap.xmax)
+    ax.set_ylim(bmap.ymin, bmap.ymax)
+    ax.set_aspect('auto')
+
+    # get the image
+    canvas.draw()
+    return numpy.asarray(canvas.buffer_rgba()).copy()
+
+
+# get the background layer from the process cache, the disk cache or by
+# rendering it from scratch
+def get_background(bmap, width, height, dpi, coastlineWidth, landColor, gridWidth, cachePath=None):
+
+    key = (bmap.resolution, bmap.xmin, bmap.ymin, bmap.xmax, bmap.ymax,
+           width, height, dpi, coastlineWidth, str(landColor), gridWidth)
+    if key in backgrounds:
+        return backgrounds[key]
+
+    # try the on-disk cache first
+    layer = None
+    filename = None
+    if cachePath:
+        keyHash = hashlib.sha1(repr(key).encode()).hexdigest()
+        filename = os.path.join(cachePath, "background_%s.npy" % keyHash)
+        if os.path.exists(filename):
+            try:
+                layer = numpy.load(filename)
+            except Exception as e:
+                print("[%s] -- Unable to load %s: %s" % (appname, filename, e))
+
+    # render the layer and persist it
+    if layer is None:
+        layer = render_background(bmap, width, height, dpi, coastlineWidth, landColor, gridWidth)
+        if filename:
+            try:
+                os.makedirs(cachePath, exist_ok=True)
+                tmpFilename = "%s.%s.tmp.npy" % (filename[:-4], os.getpid())
+                numpy.save(tmpFilename, layer)
+                os.replace(tmpFilename, filename)
+            except Exception as e:
+                print("[%s] -- Unable to save %s: %s" % (appname, filename, e))
+
+    backgrounds[key] = layer
+    return layer
+
+
+# image of the background layer of an axis. The raster is only fetched
+# when drawn, so that it is sized on the final axes box (once colorbars
+# have shrunk the axes and the aspect ratio has been applied) and at the
+# resolution the figure is saved with
+class BackgroundImage(AxesImage):
+
+    def __init__(self, ax, bmap, coastlineWidth, landColor, gridWidth, cachePath=None):
+        super().__init__(ax, origin="upper", interpolation="antialiased", zorder=1.5,
+                         extent=(bmap.xmin, bmap.xmax, bmap.ymin, bmap.ymax))
+        self.bmap = bmap
+        self.style = (coastlineWidth, landColor, gridWidth)
+        self.cachePath = cachePath
+        self.set_data(numpy.zeros((1, 1, 4), dtype=numpy.uint8))
+
+    def draw(self, renderer):
+        bbox = self.axes.bbox
+        width, height = raster_size(self.bmap, bbox.width, bbox.height)
+        self.set_data(get_background(self.bmap, width, height, self.figure.dpi, *self.style, cachePath=self.cachePath))
+        super().draw(renderer)
+
+
+# label parallels on the left and meridians on the bottom of the map, as
+# drawparallels/drawmeridians do with labels=[1,0,0,1]
+def draw_graticule_labels(bmap, ax, fontsize):
+    for lat in parallels:
+        if bmap.ymin <= lat <= bmap.ymax:
+            label = "%s\N{DEGREE SIGN}%s" % (abs(lat), "N" if lat > 0 else "S" if lat < 0 else "")
+            ax.annotate(label, xy=(bmap.xmin, lat), xytext=(-2, 0), textcoords="offset points",
+                        ha="right", va="center", fontsize=fontsize, annotation_clip=False)
+    for lon in meridians:
+        if bmap.xmin <= lon <= bmap.xmax:
+            label = "%s\N{DEGREE SIGN}%s" % (abs(lon), "E" if lon > 0 else "W" if lon < 0 else "")
+            ax.annotate(label, xy=(lon, bmap.ymin), xytext=(0, -2), textcoords="offset points",
+                        ha="center", va="top", fontsize=fontsize, annotation_clip=False)
+
+
+# draw coastlines, land and graticule on the axis of the given basemap.
+# In "vector" mode (the default) they are drawn by basemap as usual; in
+# "raster" mode the layers are rendered once per (resolution, extent,
+# dpi, panel size, style) and composited over the data
+def draw_background(bmap, ax, mode="vector", coastlineWidth=0.25, landColor="0.8",
+                    gridWidth=0.1, labelSize=2, cachePath=None):
+
+    if mode == "vector":
+        bmap.drawcoastlines(linewidth=coastlineWidth, ax=ax)
+        bmap.fillcontinents(color=landColor, ax=ax)
+        bmap.drawparallels(parallels, linewidth=gridWidth, labels=[1,0,0,1], fontsize=labelSize, ax=ax)
+        bmap.drawmeridians(meridians, linewidth=gridWidth, labels=[1,0,0,1], fontsize=labelSize, ax=ax)
+        return
+
+    # composite the raster over the data (but below streamlines and text)
+    ax.add_image(BackgroundImage(ax, bmap, coastlineWidth, landColor, gridWidth, cachePath))
+    ax.set_xlim(bmap.xmin, bmap.xmax)
+    ax.set_ylim(bmap.ymin, bmap.ymax)
+
+    # labels are cheap text, draw them on the figure
+    if labelSize:
+        draw_graticule_labels(bmap, ax, labelSize)
@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from mpl_toolkits.basemap import Basemap
+import pickle
+import copy
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "BasemapCache"
+
+# basemaps already built by this process, indexed by (resolution, extent)
+basemaps = {}
+
+
+###############################################
+#
+# basemap cache
+#
+###############################################
+
+# build the key identifying a basemap: resolution and map corners
+def basemap_key(resolution, lons, lats):
+    return (resolution,
+            round(float(lons[0]), 4), round(float(lats[0]), 4),
+            round(float(lons[-1]), 4), round(float(lats[-1]), 4))
+
+
+# load a pickled basemap from the cache folder (None if not available)
+def load_basemap(filename):
+    if not os.path.exists(filename):
+        return None
+    try:
+        with open(filename, "rb") as f:
+            return pickle.load(f)
+    except Exception as e:
+        print("[%s] -- Unable to load %s: %s" % (appname, filename, e))
+        return None
+
+
+# pickle a basemap into the cache folder. The file is written with a
+# temporary name and then renamed, so that concurrent jobs on the same
+# grid never read a half-written pickle
+def save_basemap(bmap, filename):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpFilename = "%s.%s.tmp" % (filename, os.getpid())
+        with open(tmpFilename, "wb") as f:
+            pickle.dump(bmap, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpFilename, filename)
+    except Exception as e:
+        print("[%s] -- Unable to save %s: %s" % (appname, filename, e))
+
+
+# get a basemap for the given resolution and extent, bound to the axis ax.
+# The basemap (and its coastline/polygon processing) is built only once per
+# process and, if cachePath is provided, only once per grid across jobs
+def get_basemap(resolution, lons, lats, ax=None, cachePath=None):
+
+    key = basemap_key(resolution, lons, lats)
+    if key not in basemaps:
+
+        # try the on-disk cache first
+        bmap = None
+        filename = None
+        if cachePath:
+            filename = os.path.join(cachePath, "basemap_%s_%s_%s_%s_%s.pickle" % key)
+            bmap = load_basemap(filename)
+
+        # build the basemap and persist it
+        if bmap is None:
+            bmap = Basemap(resolution=resolution,
+                           llcrnrlon=lons[0],llcrnrlat=lats[0],
+                           urcrnrlon=lons[-1],urcrnrlat=lats[-1])
+            if filename:
+                save_basemap(bmap, filename)
+                print("[%s] -- Basemap saved to %s" % (appname, filename))
+        else:
+            print("[%s] -- Basemap loaded from %s" % (appname, filename))
+
+        basemaps[key] = bmap
+
+    # return a shallow copy (coastlines and polygons are shared) bound to ax
+    bmap = copy.copy(basemaps[key])
+    bmap.ax = ax
+    return bmap
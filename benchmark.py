@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from synthetic_data import generate
+import multiprocessing
+import configparser
+import importlib
+import resource
+import traceback
+import datetime
+import json
+import time
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Benchmark"
+
+# products to benchmark: script module and config section
+products = (("mean_spread_ssh", "ssh"),
+            ("mean_spread_temperature", "temperature"),
+            ("mean_spread_salinity", "salinity"),
+            ("mean_spread_currents", "currents"),
+            ("postage_ssh", "postcardSsh"),
+            ("postage_temperature", "postcardTemp"),
+            ("postage_salinity", "postcardSalinity"),
+            ("postage_currents", "postcardCurrents"))
+
+
+###############################################
+#
+# benchmark config
+#
+###############################################
+
+# build the config of the benchmark from an operational one, redirecting
+# inputs, outputs, caches and timings inside benchPath
+def benchmark_config(configFile, benchPath):
+
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    configParser.set("default", "basePath", os.path.join(benchPath, "input"))
+    configParser.set("default", "baseEnsPath", os.path.join(benchPath, "input", "member{INSTANCE}", "{DATE}"))
+    configParser.set("default", "baseOutputPath", os.path.join(benchPath, "output"))
+    configParser.set("default", "cachePath", os.path.join(benchPath, "cache"))
+    configParser.set("default", "timingsFile", "")
+
+    benchConfigFile = os.path.join(benchPath, "benchmark.conf")
+    os.makedirs(benchPath, exist_ok=True)
+    with open(benchConfigFile, "w") as f:
+        configParser.write(f)
+    return configParser, benchConfigFile
+
+
+###############################################
+#
+# product benchmark
+#
+###############################################
+
+# sum the per-stage timings of a product
+def stage_times(timingsFile):
+    stages = {}
+    if not os.path.exists(timingsFile):
+        return stages
+    with open(timingsFile) as f:
+        for line in f:
+            record = json.loads(line)
+            stage = stages.setdefault(record["stage"], {"seconds": 0.0, "count": 0})
+            stage["seconds"] += record["seconds"]
+            stage["count"] += 1
+    return stages
+
+
+# render the first frames of a product (in a forked process, so that
+# peak memory and import costs are measured per product) and send the
+# results back through the queue
+def bench_product(benchConfigFile, inputDate, moduleName, section, frameCount, timingsFile, queue):
+    try:
+        queue.put(measure_product(benchConfigFile, inputDate, moduleName, section, frameCount, timingsFile))
+    except Exception as e:
+        traceback.print_exc()
+        queue.put({"product": moduleName, "section": section, "error": str(e)})
+
+
+# import the script of a product, prepare its frames and render the first
+# frameCount of them
+def measure_product(benchConfigFile, inputDate, moduleName, section, frameCount, timingsFile):
+
+    from frame_pool import run_frames
+
+    configParser = configparser.ConfigParser()
+    configParser.read(benchConfigFile)
+    configParser.set("default", "timingsFile", timingsFile)
+    workers = configParser.getint("default", "workers", fallback=1)
+
+    # import and prepare
+    startTime = time.time()
+    module = importlib.import_module(moduleName)
+    importTime = time.time() - startTime
+    startTime = time.time()
+    renderFrame, frames = module.prepare_frames(configParser, inputDate)
+    prepareTime = time.time() - startTime
+
+    # render
+    frames = frames[:frameCount]
+    startTime = time.time()
+    run_frames(renderFrame, frames, workers, appname)
+    renderTime = time.time() - startTime
+
+    # ru_maxrss is in kilobytes on linux
+    return {"product": moduleName,
+            "section": section,
+            "frames": len(frames),
+            "workers": workers,
+            "importSeconds": round(importTime, 3),
+            "prepareSeconds": round(prepareTime, 3),
+            "renderSeconds": round(renderTime, 3),
+            "framesPerSecond": round(len(frames) / renderTime, 3) if renderTime > 0 else None,
+            "peakRssMB": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+            "peakRssWorkersMB": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0, 1),
+            "stages": stage_times(timingsFile)}
+
+
+# run the benchmark of a product in its own process
+def run_product(benchConfigFile, benchPath, inputDate, moduleName, section, frameCount):
+
+    timingsFile = os.path.join(benchPath, "timings_%s.jsonl" % moduleName)
+    if os.path.exists(timingsFile):
+        os.remove(timingsFile)
+
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=bench_product,
+                              args=(benchConfigFile, inputDate, moduleName, section, frameCount, timingsFile, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+# print the results of a product
+def report(result):
+    if "error" in result:
+        print("[%s] -- %s: failed (%s)" % (appname, result["product"], result["error"]))
+        return
+    print("[%s] -- %s: %s frames, %.2f frames/s, peak RSS %s MB (workers %s MB), import %.1f s, prepare %.1f s" %
+          (appname, result["product"], result["frames"], result["framesPerSecond"] or 0,
+           result["peakRssMB"], result["peakRssWorkersMB"], result["importSeconds"], result["prepareSeconds"]))
+    for stage, times in sorted(result["stages"].items(), key=lambda item: -item[1]["seconds"]):
+        print("[%s] --     %-12s %8.3f s  (%s calls, %.3f s/frame)" %
+              (appname, stage, times["seconds"], times["count"], times["seconds"] / max(result["frames"], 1)))
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################
+
+    # read config file name (used as a template for the chart settings)
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+        benchPath = os.path.abspath(sys.argv[2])
+    except:
+        print("[ERROR] -- Usage: %s <configFile> <benchPath> [date]" % sys.argv[0])
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[3]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+
+    ###############################################
+    #
+    # generate the data and benchmark the products
+    #
+    ###############################################
+
+    configParser, benchConfigFile = benchmark_config(configFile, benchPath)
+    days = configParser.getint("benchmark", "days", fallback=2)
+    depths = configParser.getint("benchmark", "depths", fallback=10)
+    frameCount = configParser.getint("benchmark", "frames", fallback=4)
+    print("[%s] -- Benchmark folder set to: %s" % (appname, benchPath))
+    print("[%s] -- Days, depths and frames set to: %s, %s, %s" % (appname, days, depths, frameCount))
+
+    # synthetic inputs are generated once per date
+    doneFile = os.path.join(benchPath, "input", inputDate, ".generated_%s_%s" % (days, depths))
+    if not os.path.exists(doneFile):
+        generate(configParser, inputDate, days, depths)
+        open(doneFile, "w").close()
+
+    results = []
+    for moduleName, section in products:
+        print("[%s] -- Benchmarking %s" % (appname, moduleName))
+        result = run_product(benchConfigFile, benchPath, inputDate, moduleName, section, frameCount)
+        report(result)
+        results.append(result)
+
+    # save the results
+    resultsFile = os.path.join(benchPath, "benchmark_%s.json" % datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+    with open(resultsFile, "w") as f:
+        json.dump(results, f, indent=2)
+    print("[%s] -- Results saved to %s" % (appname, resultsFile))
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from slice_store import attach_store
+import contextlib
+import xarray
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "DatasetLoader"
+
+# names of the time and depth dimensions in the mean/std and member files
+timeDims = ("time", "time_counter")
+depthDims = ("depth", "deptht", "depthu", "depthv", "depthw")
+
+# lists collecting the datasets opened, see collect_datasets
+collectors = []
+
+
+###############################################
+#
+# dataset loading
+#
+###############################################
+
+# read the lazyLoading option of a config section, falling back to the
+# default section
+def lazy_loading(configParser, section):
+    return configParser.getboolean(section, "lazyLoading",
+                                   fallback=configParser.getboolean("default", "lazyLoading", fallback=False))
+
+
+# dask chunks holding exactly one horizontal slice per (time, depth)
+def slice_chunks(ds):
+    return {dim: 1 for dim in ds.dims if dim in timeDims or dim in depthDims}
+
+
+# open a dataset. In lazy mode the variables are backed by dask arrays
+# chunked along time and depth, so that only the slices actually plotted
+# are read from disk and memory stays bounded on larger grids. With a
+# slice store folder, the given variables are memory-mapped from it
+def open_dataset(path, lazy=False, store=None, variables=()):
+    ds = xarray.open_dataset(path)
+    for datasets in collectors:
+        datasets.append(ds)
+    if lazy:
+        ds = ds.chunk(slice_chunks(ds))
+    if store:
+        ds = attach_store(ds, variables, [path], store)
+    return ds
+
+
+# collect the datasets opened within the block (those of the members
+# included), so that long-running processes such as the render daemon can
+# close the files of the tasks they drop
+@contextlib.contextmanager
+def collect_datasets():
+    datasets = []
+    collectors.append(datasets)
+    try:
+        yield datasets
+    finally:
+        collectors.remove(datasets)
+
+
+###############################################
+#
+# ensemble loading
+#
+###############################################
+
+# paths of the member files of a postcard config section, built from the
+# baseEnsPath template and the number of members
+def member_files(configParser, section, inputDate):
+    baseEnsPathTemplate = configParser.get("default", "baseEnsPath")
+    inputFileTemplate = configParser.get(section, "inputFile")
+    members = configParser.getint("default", "members")
+    return [os.path.join(baseEnsPathTemplate.format(INSTANCE=i, DATE=inputDate), inputFileTemplate.format(DATE=inputDate))
+            for i in range(members)]
+
+
+# open the member files as a single lazily-backed cube of the given
+# variables, with dimensions (member, time, depth, lat, lon). Grid
+# coordinates and time axis are taken from the first member, so a frame of
+# all the members is fetched with a single vectorized read. With a slice
+# store folder, the variables are memory-mapped from it
+def open_ensemble(paths, variables, store=None):
+    datasets = [open_dataset(path, lazy=True)[variables] for path in paths]
+    cube = xarray.concat(datasets, dim="member", coords="minimal", compat="override", join="override")
+    if store:
+        cube = attach_store(cube, variables, paths, store)
+    return cube
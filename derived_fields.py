@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import collections
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "DerivedFields"
+
+# currents slices read by this process, with their derived fields
+currents = collections.OrderedDict()
+
+# number of slices kept in memory (a postage slice holds all the members)
+maxCurrents = 4
+
+
+###############################################
+#
+# derived fields
+#
+###############################################
+
+# fields derived from the u and v components, as float32 arrays with NaN
+# where missing: the components themselves, the speed and the unit vectors
+# (NaN where the speed is zero)
+def derive_currents(u, v):
+    u = numpy.asarray(u).astype(numpy.float32, copy=False)
+    v = numpy.asarray(v).astype(numpy.float32, copy=False)
+    speed = numpy.hypot(u, v)
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        unitU = numpy.where(speed > 0, u / speed, numpy.float32(numpy.nan))
+        unitV = numpy.where(speed > 0, v / speed, numpy.float32(numpy.nan))
+    return {"u": u, "v": v, "speed": speed, "unitU": unitU, "unitV": unitV}
+
+
+# hashable form of a slice index (slices are not hashable before 3.12)
+def index_key(index):
+    return tuple((i.start, i.stop, i.step) if isinstance(i, slice) else i for i in index)
+
+
+# read a slice of the u and v variables (index is the tuple of positional
+# indices, e.g. (timestep, depth), or (slice(None), timestep, depth) for
+# all the members of an ensemble cube) and derive its fields, once per
+# process. Returns the fields and the number of bytes read (0 when cached)
+def read_currents(dsU, uName, dsV, vName, index):
+
+    # datasets are kept in the entry, so their ids are not reused while
+    # the entry is cached
+    key = (id(dsU), uName, id(dsV), vName, index_key(index))
+    if key in currents:
+        currents.move_to_end(key)
+        return currents[key]["fields"], 0
+
+    u = dsU[uName][index].values
+    v = dsV[vName][index].values
+    fields = derive_currents(u, v)
+    currents[key] = {"datasets": (dsU, dsV), "fields": fields}
+    while len(currents) > maxCurrents:
+        currents.popitem(last=False)
+    return fields, u.nbytes + v.nbytes
@@ -0,0 +1,226 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from dataset_loader import member_files, depthDims
+import configparser
+import datetime
+import netCDF4
+import xarray
+import numpy
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "EnsembleStats"
+
+# statistics files read by the mean_spread plotters: config section,
+# variable and the options holding the names of the mean and std files
+statsFiles = (("temperature", "votemper", "meanFile", "stdFile"),
+              ("salinity", "vosaline", "meanFile", "stdFile"),
+              ("ssh", "sossheig", "meanFile", "stdFile"),
+              ("currents", "vozocrtx", "meanUFile", "stdUFile"),
+              ("currents", "vomecrty", "meanVFile", "stdVFile"))
+
+
+###############################################
+#
+# online statistics
+#
+###############################################
+
+# running statistics of a chunk, updated one member at a time with
+# Welford's algorithm (stable also when the spread is tiny compared to
+# the mean, unlike the sum of squares)
+def init_stats(shape, minMax=False):
+    stats = {"count": numpy.zeros(shape, dtype=numpy.int32),
+             "mean": numpy.zeros(shape, dtype=numpy.float64),
+             "m2": numpy.zeros(shape, dtype=numpy.float64),
+             "land": numpy.ones(shape, dtype=bool)}
+    if minMax:
+        stats["min"] = numpy.full(shape, numpy.inf)
+        stats["max"] = numpy.full(shape, -numpy.inf)
+    return stats
+
+
+# add the data of a member. Missing values are skipped, and points equal
+# to zero in all the members are marked as land (NEMO fills land with 0)
+def update_stats(stats, data):
+
+    data = numpy.asarray(data, dtype=numpy.float64)
+    valid = numpy.isfinite(data)
+    stats["count"] += valid
+    stats["land"] &= ~valid | (data == 0)
+
+    delta = numpy.where(valid, data - stats["mean"], 0.0)
+    stats["mean"] += delta / numpy.maximum(stats["count"], 1)
+    stats["m2"] += numpy.where(valid, delta * (data - stats["mean"]), 0.0)
+
+    if "min" in stats:
+        numpy.fmin(stats["min"], numpy.where(valid, data, numpy.inf), out=stats["min"])
+        numpy.fmax(stats["max"], numpy.where(valid, data, -numpy.inf), out=stats["max"])
+
+
+# final mean, standard deviation (with ddof delta degrees of freedom) and
+# min/max of a chunk, as float32 with NaN on land and missing points
+def finalize_stats(stats, ddof=0):
+    missing = stats["land"] | (stats["count"] <= ddof)
+    results = {"mean": numpy.where(missing, numpy.nan, stats["mean"]),
+               "std": numpy.sqrt(numpy.where(missing, numpy.nan, stats["m2"] / numpy.maximum(stats["count"] - ddof, 1)))}
+    if "min" in stats:
+        results["min"] = numpy.where(missing, numpy.nan, stats["min"])
+        results["max"] = numpy.where(missing, numpy.nan, stats["max"])
+    return {key: value.astype(numpy.float32) for key, value in results.items()}
+
+
+###############################################
+#
+# output files
+#
+###############################################
+
+# create a statistics file laid out like the upstream mean/std files:
+# (time, depth, lat, lon) variables with 1D coordinates
+def create_stats_file(filename, times, depths, lats, lons, variables):
+
+    nc = netCDF4.Dataset(filename, "w")
+    nc.createDimension("time", len(times))
+    nc.createDimension("lat", len(lats))
+    nc.createDimension("lon", len(lons))
+    dims = ("time", "lat", "lon")
+    if depths is not None:
+        nc.createDimension("depth", len(depths))
+        nc.createVariable("depth", "f4", ("depth",))[:] = depths
+        dims = ("time", "depth", "lat", "lon")
+
+    time = nc.createVariable("time", "f8", ("time",))
+    time.units = "seconds since 1970-01-01 00:00:00"
+    time.calendar = "standard"
+    time[:] = (numpy.asarray(times, dtype="datetime64[s]") - numpy.datetime64("1970-01-01T00:00:00", "s")).astype(numpy.float64)
+    nc.createVariable("lat", "f4", ("lat",))[:] = lats
+    nc.createVariable("lon", "f4", ("lon",))[:] = lons
+
+    for variable in variables:
+        nc.createVariable(variable, "f4", dims, fill_value=numpy.float32(numpy.nan), zlib=True, complevel=1)
+    return nc
+
+
+# compute mean and std (and optionally min/max, stored in the mean file
+# as <variable>_min and <variable>_max) of a variable over all the
+# members, reading depthChunk levels of every member at a time
+def compute_variable(memberDatasets, variable, meanFilename, stdFilename, depthChunk=1, minMax=False, ddof=0):
+
+    first = memberDatasets[0]
+    times = first.time_counter.values
+    lats = first.nav_lat.values[:, 0]
+    lons = first.nav_lon.values[0, :]
+    depthDim = next((dim for dim in first[variable].dims if dim in depthDims), None)
+    depths = first[depthDim].values if depthDim else None
+
+    # write through temporary files, so that the plotters never read
+    # partially written statistics
+    meanVariables = [variable] + (["%s_min" % variable, "%s_max" % variable] if minMax else [])
+    tmpMean = "%s.%s.tmp" % (meanFilename, os.getpid())
+    tmpStd = "%s.%s.tmp" % (stdFilename, os.getpid())
+    meanNc = create_stats_file(tmpMean, times, depths, lats, lons, meanVariables)
+    stdNc = create_stats_file(tmpStd, times, depths, lats, lons, [variable])
+
+    try:
+        chunks = [slice(None)] if depths is None else [slice(d, d + depthChunk) for d in range(0, len(depths), depthChunk)]
+        for chunk in chunks:
+
+            # one pass over the members
+            stats = None
+            for ds in memberDatasets:
+                data = ds[variable][:, chunk].values if depthDim else ds[variable].values
+                if stats is None:
+                    stats = init_stats(data.shape, minMax)
+                update_stats(stats, data)
+
+            # write the chunk
+            results = finalize_stats(stats, ddof)
+            index = (slice(None), chunk) if depthDim else (slice(None),)
+            meanNc.variables[variable][index] = results["mean"]
+            stdNc.variables[variable][index] = results["std"]
+            if minMax:
+                meanNc.variables["%s_min" % variable][index] = results["min"]
+                meanNc.variables["%s_max" % variable][index] = results["max"]
+
+    finally:
+        meanNc.close()
+        stdNc.close()
+
+    os.replace(tmpMean, meanFilename)
+    os.replace(tmpStd, stdFilename)
+    print("[%s] -- Files %s and %s generated" % (appname, meanFilename, stdFilename))
+
+
+# compute the statistics files of all the mean_spread sections from the
+# member files of a date
+def compute_stats(configParser, inputDate):
+
+    outputPath = configParser.get("ensembleStats", "outputPath", fallback=configParser.get("default", "basePath"))
+    depthChunk = configParser.getint("ensembleStats", "depthChunk", fallback=1)
+    minMax = configParser.getboolean("ensembleStats", "minMax", fallback=False)
+    ddof = configParser.getint("ensembleStats", "ddof", fallback=0)
+    print("[%s] -- Output path set to: %s" % (appname, outputPath))
+    print("[%s] -- Depth chunk set to: %s" % (appname, depthChunk))
+    print("[%s] -- Min/max set to: %s" % (appname, minMax))
+    print("[%s] -- Delta degrees of freedom set to: %s" % (appname, ddof))
+
+    # all the postcard sections read the same member files
+    inputFiles = member_files(configParser, "postcardTemp", inputDate)
+    memberDatasets = [xarray.open_dataset(inputFile) for inputFile in inputFiles]
+
+    dst = os.path.join(outputPath, inputDate)
+    os.makedirs(dst, exist_ok=True)
+    try:
+        for section, variable, meanOption, stdOption in statsFiles:
+            if not configParser.has_section(section):
+                continue
+            compute_variable(memberDatasets, variable,
+                             os.path.join(dst, configParser.get(section, meanOption)),
+                             os.path.join(dst, configParser.get(section, stdOption)),
+                             depthChunk, minMax, ddof)
+    finally:
+        for ds in memberDatasets:
+            ds.close()
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # compute the statistics
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    compute_stats(configParser, inputDate)
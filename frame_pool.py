@@ -0,0 +1,74 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import multiprocessing
+import time
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "FramePool"
+
+# function rendering a frame, set before forking the workers so that they
+# inherit it (together with the datasets and grids it refers to)
+renderer = None
+
+
+###############################################
+#
+# frame rendering
+#
+###############################################
+
+# set up a worker. Thread pools (e.g. dask's, used by lazily loaded
+# datasets) do not survive a fork, so workers compute synchronously
+def init_worker():
+    try:
+        import dask
+        dask.config.set(scheduler="synchronous")
+    except ImportError:
+        pass
+
+
+# entry point of the workers
+def render(frame):
+    return renderer(frame)
+
+
+# render all the frames, sequentially or distributing them over a pool of
+# forked worker processes, and report the aggregate frames per second.
+# Returns the list of values returned by renderFrame, in frame order
+def run_frames(renderFrame, frames, workers=1, caller=appname):
+
+    global renderer
+
+    startTime = time.time()
+    workers = max(1, min(workers, len(frames)))
+    if workers > 1:
+
+        # the workers are forked, so they inherit the already opened
+        # datasets and grid arrays instead of receiving them by pickle
+        renderer = renderFrame
+        try:
+            with multiprocessing.get_context("fork").Pool(workers, initializer=init_worker) as pool:
+                results = pool.map(render, frames, chunksize=1)
+        finally:
+            renderer = None
+
+    else:
+        results = [renderFrame(frame) for frame in frames]
+
+    # report the throughput
+    elapsed = time.time() - startTime
+    print("[%s] -- %s frames rendered in %.1f s with %s worker(s): %.2f frames/s" %
+          (caller, len(frames), elapsed, workers, len(frames) / elapsed if elapsed > 0 else 0))
+    return results
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "FrameStats"
+
+
+###############################################
+#
+# frame statistics
+#
+###############################################
+
+# parse a list of two percentiles ("1, 99"); empty means plain min/max
+def parse_percentiles(value):
+    if not value or not value.strip():
+        return None
+    percentiles = [float(p) for p in value.split(",")]
+    if len(percentiles) != 2:
+        raise ValueError("two percentiles expected, got %s" % value)
+    return percentiles
+
+
+# colour range of a frame, computed over the valid points of all the
+# members at once (data may be a masked array, e.g. from apply_mask).
+# Returns the min and max or, when given, the low and high percentiles
+def frame_range(data, percentiles=None):
+    if numpy.ma.isMaskedArray(data):
+        values = data.compressed()
+    else:
+        values = numpy.asarray(data).ravel()
+    values = values[numpy.isfinite(values)]
+    if values.size == 0:
+        return numpy.nan, numpy.nan
+    if percentiles:
+        low, high = numpy.percentile(values, percentiles)
+    else:
+        low, high = values.min(), values.max()
+    return float(low), float(high)
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import contextlib
+import json
+import time
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Instrumentation"
+
+# file receiving the timings (one JSON object per line), None to disable
+timingsFile = None
+
+# fields identifying the frame being rendered by this process
+frameInfo = {}
+frameStart = None
+
+
+###############################################
+#
+# timings
+#
+###############################################
+
+# read the timingsFile option of the default section (empty or missing
+# disables the instrumentation)
+def init_timings(configParser):
+
+    global timingsFile
+
+    timingsFile = configParser.get("default", "timingsFile", fallback="") or None
+    if timingsFile:
+        folder = os.path.dirname(timingsFile)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+    print("[%s] -- Timings file set to: %s" % (appname, timingsFile))
+
+
+# append a record to the timings file. Each record is a single short
+# write on a file opened in append mode, so that lines written by
+# concurrent worker processes do not interleave
+def emit(stage, seconds, nbytes=None):
+    if not timingsFile:
+        return
+    record = dict(frameInfo, stage=stage, seconds=round(seconds, 6),
+                  bytes=None if nbytes is None else int(nbytes))
+    with open(timingsFile, "a") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+# set the frame the following records refer to
+def set_frame(variable, date=None, day=None, depth=None):
+
+    global frameStart
+
+    frameInfo.clear()
+    frameInfo["variable"] = variable
+    frameInfo["date"] = None if date is None else str(date)
+    frameInfo["day"] = None if day is None else int(day)
+    frameInfo["depth"] = None if depth is None else float(depth)
+    frameStart = time.perf_counter()
+
+
+# record the total time spent on the current frame, along with the size
+# of the image produced
+def end_frame(filename=None):
+    if frameStart is None:
+        return
+    nbytes = os.path.getsize(filename) if filename and os.path.exists(filename) else None
+    emit("frame", time.perf_counter() - frameStart, nbytes)
+
+
+# time the enclosed block as a stage of the current frame. The yielded
+# dict lets the block report the bytes it processed, e.g.:
+#
+#     with timed("read") as t:
+#         data = ds.votemper[timestep_index,depth_index,:,:].values
+#         t["bytes"] = data.nbytes
+@contextlib.contextmanager
+def timed(stage):
+    info = {"bytes": None}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        emit(stage, time.perf_counter() - start, info["bytes"])
@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import hashlib
+import json
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Manifest"
+
+# name of the manifest written in each output folder
+manifestName = "manifest.jsonl"
+
+# options not affecting the images, in the default section as well as in
+# the product sections (lowercase, as stored by configparser)
+runtimeOptions = ("workers", "resume", "timingsfile", "tasks", "lazyloading", "cachepath", "manifestchecksum",
+                  "cachestreamlines", "slicestore")
+
+
+###############################################
+#
+# signatures
+#
+###############################################
+
+# sha1 of the content of a file, read in blocks
+def checksum(path):
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+# describe the input files by size and modification time or, when
+# checksums are requested, by the sha1 of their content
+def input_signature(paths, useChecksum=False):
+    signature = {}
+    for path in paths:
+        if not os.path.exists(path):
+            signature[path] = None
+        elif useChecksum:
+            signature[path] = checksum(path)
+        else:
+            st = os.stat(path)
+            signature[path] = [st.st_size, st.st_mtime_ns]
+    return signature
+
+
+# hash of the settings of a section that change the images, along with
+# the shared ones of the default section
+def section_hash(configParser, section):
+    settings = [(name, key, value) for name in ("default", section)
+                for key, value in configParser.items(name) if key not in runtimeOptions]
+    return hashlib.sha1(json.dumps(sorted(settings)).encode()).hexdigest()
+
+
+###############################################
+#
+# manifest
+#
+###############################################
+
+# read the entries of a manifest (the last entry of a frame wins). The
+# manifest is never rewritten, as other processes (pool workers of
+# another run, the render daemon, the watcher) may be appending to it
+def load_manifest(manifestFile):
+
+    entries = {}
+    if not os.path.exists(manifestFile):
+        return entries
+    with open(manifestFile) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+                entries[entry["key"]] = entry
+            except ValueError:
+                pass
+    return entries
+
+
+# append an entry to a manifest. Entries are single short appends, so
+# worker processes can record their frames concurrently
+def append_entry(manifestFile, entry):
+    with open(manifestFile, "a") as f:
+        f.write(json.dumps(entry) + "\n")
+
+
+# key of a frame of a section in the manifest
+def frame_key(section, frame):
+    return "%s %s" % (section, json.dumps(frame))
+
+
+# check whether the outputs of a frame are still there and were produced
+# from the same inputs and settings
+def up_to_date(entry, signature, dst):
+    if entry is None or entry["signature"] != signature:
+        return False
+    return all(os.path.exists(os.path.join(dst, output)) for output in entry["outputs"])
+
+
+# record the frames of a section in the manifest of the output folder
+# and, in resume mode, drop the frames whose inputs and settings did not
+# change since they were rendered. Returns the renderer (recording each
+# frame once rendered) and the frames still to render. With the day index
+# of every timestep, the renderer also tells the day of a frame (a
+# timestep index or a (timestep, depth) tuple) through its frame_day
+def track_frames(configParser, section, inputFiles, dst, renderFrame, frames, dayIndices=None):
+
+    resume = configParser.getboolean("default", "resume", fallback=False)
+    useChecksum = configParser.getboolean("default", "manifestChecksum", fallback=False)
+    manifestFile = os.path.join(dst, manifestName)
+    signature = {"inputs": input_signature(inputFiles, useChecksum),
+                 "config": section_hash(configParser, section)}
+
+    # skip the unchanged frames
+    if resume:
+        entries = load_manifest(manifestFile)
+        pending = [frame for frame in frames if not up_to_date(entries.get(frame_key(section, frame)), signature, dst)]
+        print("[%s] -- %s: %s of %s frames up to date" % (appname, section, len(frames) - len(pending), len(frames)))
+        frames = pending
+
+    # render a frame and record it
+    def render_frame(frame):
+        outputs = renderFrame(frame)
+        append_entry(manifestFile, {"key": frame_key(section, frame),
+                                    "signature": signature,
+                                    "outputs": [os.path.relpath(output, dst) for output in outputs]})
+        return outputs
+
+    # day of a frame
+    def frame_day(frame):
+        return int(dayIndices[frame[0] if isinstance(frame, tuple) else frame])
+
+    if dayIndices is not None:
+        render_frame.frame_day = frame_day
+    return render_frame, frames
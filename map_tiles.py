@@ -0,0 +1,368 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from dataset_loader import open_dataset, open_ensemble, member_files, lazy_loading, depthDims
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import input_signature, section_hash
+from frame_stats import parse_percentiles, frame_range
+from derived_fields import read_currents
+from slice_store import slice_store
+from masks import black_sea_mask, apply_mask
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
+from frame_pool import run_frames
+import matplotlib.pyplot as plt
+import configparser
+import datetime
+import numpy
+import json
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "MapTiles"
+
+# size in pixels of the (square) tiles
+tileSize = 256
+
+# fields of the tile layers. For each mean_spread section: the variables
+# (the speed is computed when there are two), the options holding the
+# mean and std files, the postcard section of the member fields and
+# whether values not greater than zero are land
+tileFields = {
+    "ssh": (("sossheig",), ("meanFile",), ("stdFile",), "postcardSsh", False),
+    "temperature": (("votemper",), ("meanFile",), ("stdFile",), "postcardTemp", True),
+    "salinity": (("vosaline",), ("meanFile",), ("stdFile",), "postcardSalinity", True),
+    "currents": (("vozocrtx", "vomecrty"), ("meanUFile", "meanVFile"), ("stdUFile", "stdVFile"), "postcardCurrents", True),
+}
+
+# name of the description written in each layer folder
+layerName = "layer.json"
+
+
+###############################################
+#
+# web mercator
+#
+###############################################
+
+# longitudes and latitudes of the pixel centres of an XYZ tile
+def tile_pixels(z, x, y):
+    n = 2 ** z
+    steps = (numpy.arange(tileSize) + 0.5) / tileSize
+    lons = (x + steps) / n * 360.0 - 180.0
+    lats = numpy.degrees(numpy.arctan(numpy.sinh(numpy.pi * (1 - 2 * (y + steps) / n))))
+    return lons, lats
+
+
+# column and row of the tile holding a point
+def tile_index(z, lon, lat):
+    n = 2 ** z
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1 - numpy.arcsinh(numpy.tan(numpy.radians(lat))) / numpy.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+# nearest indices of coordinates on a regular 1D axis, -1 outside it
+def axis_indices(values, axis):
+    step = (axis[-1] - axis[0]) / (len(axis) - 1)
+    indices = numpy.rint((values - axis[0]) / step).astype(int)
+    indices[(indices < 0) | (indices >= len(axis))] = -1
+    return indices
+
+
+###############################################
+#
+# tiles
+#
+###############################################
+
+# colour a tile: RGBA bytes, transparent on land and outside the grid
+def colorize(values, cmap, minValue, maxValue):
+    norm = (values.filled(minValue) - minValue) / ((maxValue - minValue) or 1)
+    rgba = cmap(norm, bytes=True)
+    rgba[..., 3] = numpy.where(numpy.ma.getmaskarray(values), 0, 255)
+    return rgba
+
+
+# render the tiles of a 2D masked field on a regular lat/lon grid for a
+# range of zoom levels. Only the tiles holding sea points are written, in
+# the z/x/y.png layout of the XYZ tile servers. Returns the number of tiles
+def render_tiles(data, lons, lats, minZoom, maxZoom, cmap, minValue, maxValue, dst):
+
+    sea = ~numpy.ma.getmaskarray(data)
+    count = 0
+    for z in range(minZoom, maxZoom + 1):
+        x0, y0 = tile_index(z, lons.min(), lats.max())
+        x1, y1 = tile_index(z, lons.max(), lats.min())
+        for x in range(x0, x1 + 1):
+            for y in range(y0, y1 + 1):
+
+                # skip the tiles without sea points
+                pixelLons, pixelLats = tile_pixels(z, x, y)
+                cols = axis_indices(pixelLons, lons)
+                rows = axis_indices(pixelLats, lats)
+                if (cols < 0).all() or (rows < 0).all():
+                    continue
+                validCols = cols[cols >= 0]
+                validRows = rows[rows >= 0]
+                if not sea[validRows.min():validRows.max() + 1, validCols.min():validCols.max() + 1].any():
+                    continue
+
+                # sample the field at the pixel centres
+                values = data[numpy.ix_(rows, cols)]
+                values[rows < 0, :] = numpy.ma.masked
+                values[:, cols < 0] = numpy.ma.masked
+                tileFolder = os.path.join(dst, str(z), str(x))
+                os.makedirs(tileFolder, exist_ok=True)
+                plt.imsave(os.path.join(tileFolder, "%s.png" % y), colorize(values, cmap, minValue, maxValue))
+                count += 1
+    return count
+
+
+###############################################
+#
+# layers
+#
+###############################################
+
+# read a horizontal slice of the variables (a stack of slices, one per
+# member, with members set) and compute the speed of vector fields
+def read_field(datasets, variables, timestep_index, depth_index, members=False):
+    index = ((slice(None),) if members else ()) + (timestep_index,) + (() if depth_index is None else (depth_index,))
+    if len(variables) == 1:
+        return datasets[0][variables[0]][index].values
+    fields, nbytes = read_currents(datasets[0], variables[0], datasets[1], variables[1], index)
+    return fields["speed"]
+
+
+# number of depth levels of a variable, None for surface fields
+def depth_count(dataArray):
+    return next((dataArray.sizes[dim] for dim in dataArray.dims if dim in depthDims), None)
+
+
+# colour range of a field: the minValue and maxValue options of its
+# section (e.g. meanMinValue) when set, otherwise the range of the data
+def field_range(configParser, section, prefix, data, percentiles):
+    minOption = "%sMinValue" % prefix if prefix else "minValue"
+    maxOption = "%sMaxValue" % prefix if prefix else "maxValue"
+    if configParser.has_option(section, minOption) and configParser.has_option(section, maxOption):
+        return configParser.getfloat(section, minOption), configParser.getfloat(section, maxOption)
+    return frame_range(data, percentiles)
+
+
+# prepare the tile layers of a date: a layer per field (mean, spread and
+# each member) of the configured sections, timestep and depth. Returns a
+# function rendering a layer, along with the list of layers to render.
+# Layers whose inputs and settings did not change are skipped
+def prepare_layers(configParser, inputDate, days=None):
+
+    ###############################################
+    #
+    # parse config file
+    #
+    ###############################################
+
+    basePath = configParser.get("default", "basePath")
+    outputPath = configParser.get("tiles", "outputPath", fallback=os.path.join(configParser.get("default", "baseOutputPath"), "tiles"))
+    sections = [s.strip() for s in configParser.get("tiles", "sections", fallback="").split(",") if s.strip()]
+    sections = [s for s in (sections or tileFields) if s in tileFields and configParser.has_section(s)]
+    fields = [f.strip() for f in configParser.get("tiles", "fields", fallback="mean, spread").split(",") if f.strip()]
+    depths = [int(d) for d in configParser.get("tiles", "depths", fallback="0").split(",") if d.strip()]
+    minZoom = configParser.getint("tiles", "minZoom", fallback=3)
+    maxZoom = configParser.getint("tiles", "maxZoom", fallback=7)
+    rangePercentiles = parse_percentiles(configParser.get("tiles", "rangePercentiles", fallback=""))
+    blackSeaMaskLat = configParser.getfloat("default", "blackSeaMaskLat")
+    blackSeaMaskLon = configParser.getfloat("default", "blackSeaMaskLon")
+    print("[%s] -- Output path set to: %s" % (appname, outputPath))
+    print("[%s] -- Sections set to: %s" % (appname, sections))
+    print("[%s] -- Fields set to: %s" % (appname, fields))
+    print("[%s] -- Depth indices set to: %s" % (appname, depths or "all"))
+    print("[%s] -- Zoom levels set to: %s-%s" % (appname, minZoom, maxZoom))
+    print("[%s] -- Range percentiles set to: %s" % (appname, rangePercentiles))
+    init_timings(configParser)
+    tilesHash = section_hash(configParser, "tiles")
+    useChecksum = configParser.getboolean("default", "manifestChecksum", fallback=False)
+
+
+    ###############################################
+    #
+    # sources
+    #
+    ###############################################
+
+    # a source per section and field: datasets, variables, grid, colour
+    # map and config section/prefix of the colour range
+    sources = {}
+    for section in sections:
+        variables, meanOptions, stdOptions, postcardSection, positive = tileFields[section]
+        set_frame(section, inputDate)
+        if "mean" in fields or "spread" in fields:
+            lazy = lazy_loading(configParser, section)
+            store = slice_store(configParser, section, inputDate)
+            for field, options, prefix in (("mean", meanOptions, "mean"), ("spread", stdOptions, "std")):
+                if field not in fields:
+                    continue
+                inputFiles = [os.path.join(basePath, inputDate, configParser.get(section, option)) for option in options]
+                with timed("open"):
+                    datasets = [open_dataset(inputFile, lazy, store, [variable]) for inputFile, variable in zip(inputFiles, variables)]
+                sources[(section, field)] = {"datasets": datasets, "variables": variables, "inputs": inputFiles,
+                                             "lats": datasets[0].lat.values, "lons": datasets[0].lon.values,
+                                             "times": datasets[0].time.values, "members": False,
+                                             "depths": depth_count(datasets[0][variables[0]]),
+                                             "colorMap": configParser.get(section, "%sColorMap" % prefix),
+                                             "rangeSection": section, "rangePrefix": prefix,
+                                             "positive": positive and field == "mean"}
+        if "members" in fields and configParser.has_section(postcardSection):
+            inputFiles = member_files(configParser, postcardSection, inputDate)
+            with timed("open"):
+                cube = open_ensemble(inputFiles, list(variables), slice_store(configParser, postcardSection, inputDate))
+            sources[(section, "members")] = {"datasets": [cube] * len(variables), "variables": variables, "inputs": inputFiles,
+                                             "lats": cube.nav_lat.values[:, 0], "lons": cube.nav_lon.values[0, :],
+                                             "times": cube.time_counter.values, "members": True,
+                                             "depths": depth_count(cube[variables[0]]),
+                                             "colorMap": configParser.get(postcardSection, "colorMap"),
+                                             "rangeSection": postcardSection, "rangePrefix": "",
+                                             "positive": positive}
+
+    # layers of the requested days and depths, skipping the layers already
+    # rendered from the same inputs and settings
+    layers = []
+    for key, source in sources.items():
+        section, field = key
+        source["signature"] = {"inputs": input_signature(source["inputs"], useChecksum),
+                               "config": section_hash(configParser, source["rangeSection"]),
+                               "tiles": tilesHash}
+        source["dates"], months, source["hours"] = timestep_labels(source["times"])
+        uniqueDays, source["dayIndices"] = day_groups(source["times"])
+        lons, lats = numpy.meshgrid(source["lons"], source["lats"])
+        source["mask"] = black_sea_mask(lats, lons, blackSeaMaskLat, blackSeaMaskLon)
+        source["cmap"] = plt.get_cmap(source["colorMap"])
+        depthIndices = [None] if source["depths"] is None else [d for d in (depths or range(source["depths"])) if d < source["depths"]]
+        for timestep_index in timesteps_for_days(source["times"], days):
+            for depth_index in depthIndices:
+                layer = (section, field, int(timestep_index), depth_index)
+                layerFile = os.path.join(layer_folder(outputPath, inputDate, source, layer, None), layerName)
+                if not up_to_date(layerFile, source["signature"]):
+                    layers.append(layer)
+    print("[%s] -- %s tile layers to render" % (appname, len(layers)))
+
+
+    ###############################################
+    #
+    # layer rendering
+    #
+    ###############################################
+
+    # render the tiles of a layer (one folder per member for the member
+    # fields) and describe it in a json file, written last
+    def render_layer(layer):
+
+        section, field, timestep_index, depth_index = layer
+        source = sources[(section, field)]
+        set_frame(section, source["dates"][timestep_index], source["dayIndices"][timestep_index], depth_index)
+
+        with timed("read") as t:
+            data = read_field(source["datasets"], source["variables"], timestep_index, depth_index, source["members"])
+            t["bytes"] = data.nbytes
+        with timed("mask"):
+            data = apply_mask(data, source["mask"], positive=source["positive"])
+
+        # members share the ensemble-wide range
+        with timed("minmax"):
+            minValue, maxValue = field_range(configParser, source["rangeSection"], source["rangePrefix"], data, rangePercentiles)
+
+        tiles = 0
+        with timed("tiles"):
+            stack = data if source["members"] else [data]
+            for member, memberData in enumerate(stack):
+                dst = layer_folder(outputPath, inputDate, source, layer, member if source["members"] else None)
+                tiles += render_tiles(memberData, source["lons"], source["lats"], minZoom, maxZoom,
+                                      source["cmap"], minValue, maxValue, dst)
+
+        layerFile = os.path.join(layer_folder(outputPath, inputDate, source, layer, None), layerName)
+        os.makedirs(os.path.dirname(layerFile), exist_ok=True)
+        with open(layerFile, "w") as f:
+            json.dump({"signature": source["signature"], "colorMap": source["colorMap"],
+                       "minValue": minValue, "maxValue": maxValue, "minZoom": minZoom, "maxZoom": maxZoom,
+                       "members": len(stack) if source["members"] else None, "tiles": tiles}, f)
+        end_frame(layerFile)
+        return [layerFile]
+
+    return render_layer, layers
+
+
+# folder of a layer: <outputPath>/<date>/<section>/<field>/<timestep>[_depth<d>][/member<m>]
+def layer_folder(outputPath, inputDate, source, layer, member=None):
+    section, field, timestep_index, depth_index = layer
+    name = "%s_%s30" % (source["dates"][timestep_index], source["hours"][timestep_index])
+    if depth_index is not None:
+        name = "%s_depth%s" % (name, depth_index)
+    folder = os.path.join(outputPath, inputDate, section, field, name)
+    if member is not None:
+        folder = os.path.join(folder, "member%s" % member)
+    return folder
+
+
+# check whether a layer was rendered from the same inputs and settings
+def up_to_date(layerFile, signature):
+    if not os.path.exists(layerFile):
+        return False
+    try:
+        with open(layerFile) as f:
+            return json.load(f)["signature"] == signature
+    except (ValueError, KeyError):
+        return False
+
+
+# render the tile layers of a date, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderLayer, layers = prepare_layers(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    return run_frames(renderLayer, layers, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all")
+    try:
+        days = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+
+    # render the tiles
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
@@ -0,0 +1,43 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Masks"
+
+
+###############################################
+#
+# masks
+#
+###############################################
+
+# boolean mask of the Black Sea points (north of blackSeaMaskLat and east of
+# blackSeaMaskLon) of a 2D grid, e.g. the one returned by meshgrid. It only
+# depends on the grid, so it is built once and reused by every frame
+def black_sea_mask(lats, lons, blackSeaMaskLat, blackSeaMaskLon):
+    return (numpy.asarray(lats) > blackSeaMaskLat) & (numpy.asarray(lons) > blackSeaMaskLon)
+
+
+# mask a slice (or a stack of slices, e.g. one per member) with a
+# precomputed grid mask. The result is a masked view sharing the buffer
+# of data: missing values are masked along with the grid mask and, when
+# positive is set, the points not greater than zero (land in the
+# temperature and salinity files) are masked too
+def apply_mask(data, mask, positive=False):
+    data = numpy.asarray(data)
+    with numpy.errstate(invalid="ignore"):
+        invalid = ~(data > 0) if positive else ~numpy.isfinite(data)
+    return numpy.ma.array(data, mask=invalid | mask, copy=False)
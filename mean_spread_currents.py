@@ -6,19 +6,26 @@
 #
 ###############################################
 
-from mpl_toolkits.basemap import Basemap
+from background_layer import draw_background
+from frame_pool import run_frames
+from basemap_cache import get_basemap
+from dataset_loader import open_dataset, lazy_loading
+from slice_store import slice_store
+from derived_fields import read_currents
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import track_frames
+from panel_raster import save_crops, output_resolutions
+from raster_engine import render_engine, draw_raster
+from streamlines import get_streamlines, draw_streamlines
+from vector_arrows import vector_mode, draw_quiver
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
 import matplotlib.pyplot as plt
 from numpy import meshgrid
 from numpy import linspace
 import configparser
-import numpy as np
-import traceback
 import datetime
 import warnings
-import xarray
 import numpy
-import math
-import pdb
 import sys
 import os
 
@@ -37,50 +44,20 @@ appname = "Plotcurrents"
 
 ###############################################
 #
-# main
+# frames preparation
 #
 ###############################################
 
-if __name__ == "__main__":
+# read the configuration, open the datasets and return the function
+# rendering a single frame, along with the list of frames to render
+def prepare_frames(configParser, inputDate, days=None):
 
-    ###############################################
-    #
-    # read input parameters
-    #
-    ###############################################    
-    
-    # read config file name
-    configFile = None
-    try:
-        configFile = sys.argv[1]
-    except:
-        print("[ERROR] -- Config file not provided!")
-        sys.exit(1)
-
-    # read date
-    inputDate = None
-    try:
-        inputDate = sys.argv[2]
-    except:
-        inputDate = datetime.datetime.today().strftime("%Y%m%d")
-
-    # read day index
-    day_index = None
-    try:
-        day_index = int(sys.argv[3])
-    except:
-        day_index = 0
-
-        
     ###############################################
     #
     # parse config file
     #
     ###############################################
         
-    configParser = configparser.ConfigParser()
-    configParser.read(configFile)
-
     # paths
     basePath = configParser.get("default", "basePath")
     baseOutputPath = configParser.get("default", "baseOutputPath")
@@ -90,6 +67,9 @@ if __name__ == "__main__":
     stdVFile = os.path.join(basePath, inputDate, configParser.get("currents", "stdVFile"))
     outputFolder = configParser.get("currents", "outputFolder")
     outputFileTemplate = configParser.get("currents", "outputName")
+    outputMeanTemplate = configParser.get("currents", "outputMeanName", fallback=None)
+    outputSpreadTemplate = configParser.get("currents", "outputSpreadName", fallback=None)
+    outputResolutions = output_resolutions(configParser, "currents")
     print("[%s] -- Mean U file set to: %s" % (appname, meanUFile))
     print("[%s] -- Mean V file set to: %s" % (appname, meanVFile))
     print("[%s] -- Std U file set to: %s" % (appname, stdUFile))
@@ -100,6 +80,7 @@ if __name__ == "__main__":
     if not os.path.exists(dst):
         os.makedirs(dst, exist_ok=True)
     print("[%s] -- Output folder set to: %s" % (appname, dst))
+    print("[%s] -- Additional resolutions set to: %s" % (appname, outputResolutions))
 
     # chart details
     meanColorMap = configParser.get("currents", "meanColorMap")
@@ -111,6 +92,13 @@ if __name__ == "__main__":
     stdMaxValue = configParser.getfloat("currents", "stdMaxValue")
     stdLevels = configParser.getint("currents", "stdLevels")    
     resolution = configParser.get("currents", "resolution")
+    cachePath = configParser.get("default", "cachePath", fallback=None)
+    backgroundLayer = configParser.get("default", "backgroundLayer", fallback="vector")
+    renderEngine = render_engine(configParser, "currents")
+    vectorMode, quiverSpacing = vector_mode(configParser, "currents")
+    cacheStreamlines = configParser.getboolean("currents", "cacheStreamlines", fallback=configParser.getboolean("default", "cacheStreamlines", fallback=False))
+    lazyLoading = lazy_loading(configParser, "currents")
+    sliceStore = slice_store(configParser, "currents", inputDate)
     print("[%s] -- Mean color map set to: %s" % (appname, meanColorMap))
     print("[%s] -- Mean min value set to: %s" % (appname, meanMinValue))
     print("[%s] -- Mean max value set to: %s" % (appname, meanMaxValue))
@@ -118,6 +106,14 @@ if __name__ == "__main__":
     print("[%s] -- Std min value set to: %s" % (appname, stdMinValue))
     print("[%s] -- Std max value set to: %s" % (appname, stdMaxValue))
     print("[%s] -- Resolution set to: %s" % (appname, resolution))
+    print("[%s] -- Cache path set to: %s" % (appname, cachePath))
+    print("[%s] -- Background layer mode set to: %s" % (appname, backgroundLayer))
+    print("[%s] -- Render engine set to: %s" % (appname, renderEngine))
+    print("[%s] -- Streamline cache set to: %s" % (appname, cacheStreamlines))
+    print("[%s] -- Vector mode set to: %s (quiver spacing %s px)" % (appname, vectorMode, quiverSpacing))
+    init_timings(configParser)
+    print("[%s] -- Lazy loading set to: %s" % (appname, lazyLoading))
+    print("[%s] -- Slice store set to: %s" % (appname, sliceStore))
 
     
     ###############################################
@@ -127,12 +123,15 @@ if __name__ == "__main__":
     ###############################################
     
     # open datasets STD    
-    ds1u = xarray.open_dataset(stdUFile)
-    ds1v = xarray.open_dataset(stdVFile)
+    set_frame("currents", inputDate)
+    with timed("open"):
+        ds1u = open_dataset(stdUFile, lazyLoading, sliceStore, ["vozocrtx"])
+        ds1v = open_dataset(stdVFile, lazyLoading, sliceStore, ["vomecrty"])
 
     # open datasets MEAN
-    ds2u = xarray.open_dataset(meanUFile)
-    ds2v = xarray.open_dataset(meanVFile)
+    with timed("open"):
+        ds2u = open_dataset(meanUFile, lazyLoading, sliceStore, ["vozocrtx"])
+        ds2v = open_dataset(meanVFile, lazyLoading, sliceStore, ["vomecrty"])
     
     # grid indices
     x = ds1u.lon.values
@@ -149,160 +148,215 @@ if __name__ == "__main__":
     # create the grid
     xxx, yyy = meshgrid(lons, lats)
 
-    # define a timestep index (to keep track of the timesteps) and an index to keep track of the day we are in
-    timestep_index = 0
-    day_current_index = 0
-    old_day = str(ds1u.time[0].values).split("T")[0]
-    
-    # iterate over the timestamps
-    for t in ds1u.time.values:
+    # map the requested days straight to their timesteps and compute the
+    # date labels of all the timesteps at once
+    timesteps = timesteps_for_days(ds1u.time.values, days)
+    dates, months, hours = timestep_labels(ds1u.time.values)
+    uniqueDays, dayIndices = day_groups(ds1u.time.values)
 
-        # get the date of the current timestep, and optionally update the variable and index keeping track of the day
-        d1 = str(t).split("T")[0]
-        if d1 != old_day:
-            old_day = d1
-            day_current_index += 1
+    # collect the frames (timestep and depth indices) of the requested days
+    frames = [(int(timestep_index), depth_index) for timestep_index in timesteps for depth_index in range(len(ds1u.depth.values))]
+
+    # render a frame
+    def render_frame(frame):
+
+        timestep_index, depth_index = frame
+        d = ds1u.depth.values[depth_index]
 
         # get days string
-        d1 = str(t).split("T")[0]        
-        hour = str(t).split("T")[1].split(":")[0]
-        minu = str(t).split("T")[1].split(":")[1]
-        d2 = "%s:%s" % (hour, minu)
-        d3 = "%s, %s" % (d1, d2)
+        d1 = dates[timestep_index]
+        hour = hours[timestep_index]
         d4 = "%s_%s30" % (d1, hour)
+        set_frame("currents", d1, dayIndices[timestep_index], d)
 
-        # check if it's the desired day, otherwise move on
-        if day_current_index != day_index:
-            timestep_index += 1
-            continue
-        
-        # iterate over depth
-        depth_index = 0
-        for d in ds1u.depth.values:
-        
-            fig, axes = plt.subplots(nrows=2, ncols=1)
-            
-            ax_index = 0
-            for ax in axes.flat:
-
-                if ax_index == 1:
-                
-                    ############################################
-                    #
-                    # Std
-                    #
-                    ############################################
-        
-                    # initialise the map
-                    bmap = Basemap(resolution=resolution,
-                                   llcrnrlon=lons[0],llcrnrlat=lats[0],
-                                   urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
-                    
-                    # contourf STD
-                    stdLevelsContourf = linspace(stdMinValue, stdMaxValue, num=stdLevels+1)
-                    std_data_0u =  ds1u.vozocrtx[timestep_index,depth_index,:,:].values
-                    std_data_0v =  ds1v.vomecrty[timestep_index,depth_index,:,:].values
-                    std_data = numpy.sqrt(std_data_0u ** 2 +  std_data_0v ** 2)
-                    
-                    # contourf
-                    std_colormesh = ax.contourf(xxx, yyy, std_data, cmap=stdColorMap, linewidths=0.3, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue, extend='both')
-            
-                    # colorbar STD
+        fig, axes = plt.subplots(nrows=2, ncols=1)
+
+        ax_index = 0
+        for ax in axes.flat:
+
+            if ax_index == 1:
+
+                ############################################
+                #
+                # Std
+                #
+                ############################################
+
+                # initialise the map
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
+
+                # contourf STD
+                stdLevelsContourf = linspace(stdMinValue, stdMaxValue, num=stdLevels+1)
+                with timed("read") as t:
+                    std_currents, t["bytes"] = read_currents(ds1u, "vozocrtx", ds1v, "vomecrty", (timestep_index, depth_index))
+                std_data = std_currents["speed"]
+
+                # contourf
+                with timed(renderEngine):
+                    if renderEngine == "raster":
+                        std_colormesh = draw_raster(ax, xxx, yyy, std_data, stdColorMap, stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue)
+                    else:
+                        std_colormesh = ax.contourf(xxx, yyy, std_data, cmap=stdColorMap, linewidths=0.3, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue, extend='both')
+
+                # colorbar STD
+                with timed("colorbar"):
                     stdTicks = numpy.arange(stdMinValue, stdMaxValue+0.1, 0.1)
                     std_cb = bmap.colorbar(std_colormesh, location='right', ticks = stdTicks, ax=ax)
                     std_cb.set_label("Spread (m/s)", fontsize=5)
                     for t in std_cb.ax.get_yticklabels():
                         t.set_fontsize(3)
 
-                    # draw coastlines, country boundaries, fill continents.
-                    bmap.drawcoastlines(linewidth=0.15)
-                    bmap.fillcontinents()
-                    bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                    bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-
-                    # title
-                    finalDate = d1 # "%s:30" % (d3.split(":")[0])
-                    ax.set_title("Ensemble spread for currents.\nDaily mean: %s" % (finalDate), fontsize = 5)
-                        
-                else:
-                    
-                    ############################################
-                    #
-                    # Mean
-                    #
-                    ############################################
-                    
-                    # contour MEAN
-                    meanLevelsContour = linspace(meanMinValue, meanMaxValue, num=meanLevels)            
-        
-                    # u and v, then norm
-                    mean_data_0u =  ds2u.vozocrtx[timestep_index,depth_index,:,:].values
-                    mean_data_0v =  ds2v.vomecrty[timestep_index,depth_index,:,:].values
-                    mean_data = numpy.sqrt(mean_data_0u ** 2 + mean_data_0v ** 2)
-        
-                    # initialise the map
-                    bmap = Basemap(resolution=resolution,
-                                   llcrnrlon=lons[0],llcrnrlat=lats[0],
-                                   urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
-                                
-                    # contour
-                    mean_colormesh = ax.contourf(xxx, yyy, mean_data, cmap=meanColorMap, levels=meanLevelsContour, linewidths=0.3, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
-            
-                    # colorbar MEAN
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.25, landColor="white", cachePath=cachePath)
+
+                # title
+                finalDate = d1 # "%s:30" % (d3.split(":")[0])
+                ax.set_title("Ensemble spread for currents.\nDaily mean: %s" % (finalDate), fontsize = 5)
+
+            else:
+
+                ############################################
+                #
+                # Mean
+                #
+                ############################################
+
+                # contour MEAN
+                meanLevelsContour = linspace(meanMinValue, meanMaxValue, num=meanLevels)            
+
+                # u and v, read once for the norm and the vectors
+                with timed("read") as t:
+                    mean_currents, t["bytes"] = read_currents(ds2u, "vozocrtx", ds2v, "vomecrty", (timestep_index, depth_index))
+                mean_data = mean_currents["speed"]
+
+                # initialise the map
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
+
+                # contour
+                with timed(renderEngine):
+                    if renderEngine == "raster":
+                        mean_colormesh = draw_raster(ax, xxx, yyy, mean_data, meanColorMap, meanLevelsContour, vmin=meanMinValue, vmax=meanMaxValue)
+                    else:
+                        mean_colormesh = ax.contourf(xxx, yyy, mean_data, cmap=meanColorMap, levels=meanLevelsContour, linewidths=0.3, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
+
+                # colorbar MEAN
+                with timed("colorbar"):
                     meanTicks = numpy.arange(int(meanMinValue), int(meanMaxValue)+1, 0.1)
                     mean_cb = bmap.colorbar(mean_colormesh, ticks=meanTicks, location="right", ax=ax)
                     mean_cb.set_label("Mean currents (m/s)", fontsize=5)
                     for t in mean_cb.ax.get_yticklabels():
                         t.set_fontsize(3)
 
-                    # draw coastlines, country boundaries, fill continents.
-                    bmap.drawcoastlines(linewidth=0.25)
-                    bmap.fillcontinents(color='white')                        
-                    bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                    bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-
-                    # title
-                    finalDate = d1 # "%s:30" % (d3.split(":")[0])
-                    ax.set_title("Ensemble mean for currents.\nDaily mean: %s" % (finalDate), fontsize = 5)
-                    
-                    # Mean vector
-                    
-                    u = ds2u.vozocrtx[timestep_index,depth_index,::,::].values
-                    v = ds2v.vomecrty[timestep_index,depth_index,::,::].values
-        
-                    # Normalize the arrows:
-                    uu = u / np.sqrt(u**2 + v**2)
-                    vv = v / np.sqrt(u**2 + v**2)
-                    
-                    xx = xxx[::,::]
-                    yy = yyy[::,::]
-                    
-                    # quiver
-                    mean_colormesh = bmap.streamplot(xx, yy, u, v, linewidth=0.3, arrowsize=0.3, density=3, color='k') # , scale=50)    #  headlength=3, headwidth=1,
-
-                ax_index += 1
-                
-            ############################################
-            #
-            # general configuration
-            #
-            ############################################                        
-                            
-            # draw coastlines, country boundaries, fill continents.
-            bmap.drawcoastlines(linewidth=0.25)
-            bmap.fillcontinents(color='white')
-                
-            # save file
-            filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=depth_index))
-            plt.savefig(filename, dpi=300, bbox_inches="tight")
-            print("File %s generated" % filename)
-            
-            # clear memory
-            fig.clear()
-            plt.close(fig)
-
-            # increment depth index
-            depth_index += 1
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.25, landColor="white", cachePath=cachePath)
+
+                # title
+                finalDate = d1 # "%s:30" % (d3.split(":")[0])
+                ax.set_title("Ensemble mean for currents.\nDaily mean: %s" % (finalDate), fontsize = 5)
+
+                # Mean vector
+                u = mean_currents["u"]
+                v = mean_currents["v"]
+
+                xx = xxx[::,::]
+                yy = yyy[::,::]
+
+                # quiver (of the cached unit vectors) or streamlines
+                with timed(vectorMode):
+                    if vectorMode == "quiver":
+                        mean_colormesh = draw_quiver(ax, xx, yy, mean_currents["unitU"], mean_currents["unitV"], dpi=300, spacing=quiverSpacing, color='k')
+                    elif cacheStreamlines:
+                        geometry = get_streamlines(xx, yy, u, v, 3, cachePath=cachePath)
+                        mean_colormesh = draw_streamlines(bmap, ax, geometry, linewidth=0.3, arrowsize=0.3, color='k')
+                    else:
+                        mean_colormesh = bmap.streamplot(xx, yy, u, v, linewidth=0.3, arrowsize=0.3, density=3, color='k') # , scale=50)    #  headlength=3, headwidth=1,
+
+            ax_index += 1
+
+        # save the combined figure and, when configured, the mean and the
+        # spread panels (with their colorbars) cut from the same raster
+        filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=depth_index))
+        outputs = [(filename, None)]
+        if outputMeanTemplate:
+            outputs.append((os.path.join(dst, outputMeanTemplate.format(DATE=d4, DEPTH=depth_index)), [axes.flat[0], mean_cb.ax]))
+        if outputSpreadTemplate:
+            outputs.append((os.path.join(dst, outputSpreadTemplate.format(DATE=d4, DEPTH=depth_index)), [axes.flat[1], std_cb.ax]))
+        with timed("savefig") as t:
+            written = save_crops(fig, outputs, dpi=300, resolutions=outputResolutions)
+            t["bytes"] = sum(os.path.getsize(output) for output in written)
+        for output in written:
+            print("File %s generated" % output)
+
+        # clear memory
+        fig.clear()
+        plt.close(fig)
+        end_frame(filename)
+
+        return written
+
+    # skip the frames already rendered from the same inputs (resume mode)
+    return track_frames(configParser, "currents", [meanUFile, meanVFile, stdUFile, stdVFile], dst, render_frame, frames, dayIndices)
+
+
+# render all the frames, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderFrame, frames = prepare_frames(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    return run_frames(renderFrame, frames, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################    
     
-        # increment timestep index
-        timestep_index += 1
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all")
+    days = None
+    try:
+        days = parse_days(sys.argv[3])
+    except IndexError:
+        days = [0]
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+    print("[%s] -- Days set to: %s" % (appname, "all" if days is None else days))
+
+        
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+        
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
@@ -6,22 +6,28 @@
 #
 ###############################################
 
-from matplotlib.colors import ListedColormap, LinearSegmentedColormap
-from mpl_toolkits.basemap import Basemap
+from matplotlib.colors import ListedColormap
+from background_layer import draw_background
+from frame_pool import run_frames
+from basemap_cache import get_basemap
+from dataset_loader import open_dataset, lazy_loading
+from slice_store import slice_store
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import track_frames
+from panel_raster import save_crops, output_resolutions
+from raster_engine import render_engine, draw_raster
+from masks import black_sea_mask, apply_mask
+from frame_stats import frame_range
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
 import matplotlib.pyplot as plt
 from numpy import meshgrid
 from numpy import linspace
 from matplotlib import cm
 import configparser
 import numpy as np
-import matplotlib
-import traceback
 import datetime
 import warnings
-import xarray
 import numpy
-import math
-import pdb
 import sys
 import os
 
@@ -39,50 +45,20 @@ appname = "Plotssh"
 
 ###############################################
 #
-# main
+# frames preparation
 #
 ###############################################
 
-if __name__ == "__main__":
-
-    ###############################################
-    #
-    # read input parameters
-    #
-    ###############################################    
-    
-    # read config file name
-    configFile = None
-    try:
-        configFile = sys.argv[1]
-    except:
-        print("[ERROR] -- Config file not provided!")
-        sys.exit(1)
-
-    # read date
-    inputDate = None
-    try:
-        inputDate = sys.argv[2]
-    except:
-        inputDate = datetime.datetime.today().strftime("%Y%m%d")
-
-    # read day index
-    day_index = None
-    try:
-        day_index = int(sys.argv[3])
-    except:
-        day_index = 0
+# read the configuration, open the datasets and return the function
+# rendering a single frame, along with the list of frames to render
+def prepare_frames(configParser, inputDate, days=None):
 
-        
     ###############################################
     #
     # parse config file
     #
     ###############################################
         
-    configParser = configparser.ConfigParser()
-    configParser.read(configFile)
-
     # paths
     basePath = configParser.get("default", "basePath")
     baseOutputPath = configParser.get("default", "baseOutputPath")
@@ -90,6 +66,9 @@ if __name__ == "__main__":
     stdFile = os.path.join(basePath, inputDate, configParser.get("ssh", "stdFile"))
     outputFolder = configParser.get("ssh", "outputFolder")
     outputFileTemplate = configParser.get("ssh", "outputName")    
+    outputMeanTemplate = configParser.get("ssh", "outputMeanName", fallback=None)
+    outputSpreadTemplate = configParser.get("ssh", "outputSpreadName", fallback=None)
+    outputResolutions = output_resolutions(configParser, "ssh")
     print("[%s] -- Mean file set to: %s" % (appname, meanFile))
     print("[%s] -- Std file set to: %s" % (appname, stdFile))
 
@@ -98,6 +77,7 @@ if __name__ == "__main__":
     if not os.path.exists(dst):
         os.makedirs(dst, exist_ok=True)
     print("[%s] -- Output folder set to: %s" % (appname, dst))
+    print("[%s] -- Additional resolutions set to: %s" % (appname, outputResolutions))
 
     # black sea mask
     blackSeaMaskLat = configParser.getfloat("default", "blackSeaMaskLat")
@@ -114,6 +94,11 @@ if __name__ == "__main__":
     stdMaxValue = configParser.getfloat("ssh", "stdMaxValue")
     stdLevels = configParser.getint("ssh", "stdLevels")    
     resolution = configParser.get("ssh", "resolution")
+    cachePath = configParser.get("default", "cachePath", fallback=None)
+    backgroundLayer = configParser.get("default", "backgroundLayer", fallback="vector")
+    renderEngine = render_engine(configParser, "ssh")
+    lazyLoading = lazy_loading(configParser, "ssh")
+    sliceStore = slice_store(configParser, "ssh", inputDate)
     print("[%s] -- Mean color map set to: %s" % (appname, meanColorMap))
     print("[%s] -- Mean min value set to: %s" % (appname, meanMinValue))
     print("[%s] -- Mean max value set to: %s" % (appname, meanMaxValue))
@@ -121,6 +106,12 @@ if __name__ == "__main__":
     print("[%s] -- Std min value set to: %s" % (appname, stdMinValue))
     print("[%s] -- Std max value set to: %s" % (appname, stdMaxValue))
     print("[%s] -- Resolution set to: %s" % (appname, resolution))
+    print("[%s] -- Cache path set to: %s" % (appname, cachePath))
+    print("[%s] -- Background layer mode set to: %s" % (appname, backgroundLayer))
+    print("[%s] -- Render engine set to: %s" % (appname, renderEngine))
+    init_timings(configParser)
+    print("[%s] -- Lazy loading set to: %s" % (appname, lazyLoading))
+    print("[%s] -- Slice store set to: %s" % (appname, sliceStore))
 
     
     ###############################################
@@ -130,10 +121,13 @@ if __name__ == "__main__":
     ###############################################
     
     # open dataset STD    
-    ds1 = xarray.open_dataset(stdFile)
+    set_frame("ssh", inputDate)
+    with timed("open"):
+        ds1 = open_dataset(stdFile, lazyLoading, sliceStore, ["sossheig"])
 
     # open dataset MEAN
-    ds2 = xarray.open_dataset(meanFile)
+    with timed("open"):
+        ds2 = open_dataset(meanFile, lazyLoading, sliceStore, ["sossheig"])
     
     # grid indices
     x = ds1.lon.values
@@ -150,51 +144,45 @@ if __name__ == "__main__":
     # create the grid
     xxx, yyy = meshgrid(lons, lats)
 
-    # define a timestep index (to keep track of the timesteps) and an index to keep track of the day we are in
-    timestep_index = 0
-    day_current_index = 0
-    old_day = str(ds1.time[0].values).split("T")[0]
+    # the black sea mask only depends on the grid, build it once
+    blackSeaMask = black_sea_mask(yyy, xxx, blackSeaMaskLat, blackSeaMaskLon)
 
-    # iterate over the timestamps
-    for t in ds1.time.values:
+    # map the requested days straight to their timesteps and compute the
+    # date labels of all the timesteps at once
+    timesteps = timesteps_for_days(ds1.time.values, days)
+    dates, months, hours = timestep_labels(ds1.time.values)
+    uniqueDays, dayIndices = day_groups(ds1.time.values)
 
-        # get the date of the current timestep, and optionally update the variable and index keeping track of the day
-        d1 = str(t).split("T")[0]
-        if d1 != old_day:
-            old_day = d1
-            day_current_index += 1
+    # collect the frames (timestep indices) of the requested days
+    frames = [int(timestep_index) for timestep_index in timesteps]
 
-        # get days string
-        d1 = str(t).split("T")[0]        
-        hour = str(t).split("T")[1].split(":")[0]
-        minu = str(t).split("T")[1].split(":")[1]
-        d2 = "%s:%s" % (hour, minu)
-        d3 = "%s, %s" % (d1, d2)
-        d4 = "%s_%s30" % (d1, hour)
+    # render a frame
+    def render_frame(frame):
 
-        # check if it's the desired day, otherwise move on
-        if day_current_index != day_index:
-            timestep_index += 1
-            continue
+        timestep_index = frame
 
+        # get days string
+        d1 = dates[timestep_index]
+        hour = hours[timestep_index]
+        d4 = "%s_%s30" % (d1, hour)
+        set_frame("ssh", d1, dayIndices[timestep_index])
 
         fig, axes = plt.subplots(nrows=2, ncols=1)
-            
+
         ax_index = 0
         for ax in axes.flat:
-            
+
             if ax_index == 0:
-                       
+
                 ############################################
                 #
                 # Mean
                 #
                 ############################################
-                
+
                 # initialise the map
-                bmap = Basemap(resolution=resolution,
-                               llcrnrlon=lons[0],llcrnrlat=lats[0],
-                               urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
 
                 # customize colormap
                 min_val, max_val = 0.2, 1.0
@@ -202,33 +190,34 @@ if __name__ == "__main__":
                 orig_cmap = cm.gist_rainbow
                 colors = orig_cmap(np.linspace(min_val, max_val, n))
                 cmap = cm.colors.LinearSegmentedColormap.from_list("mycmap", colors)
-                
+
                 # contour MEAN
                 meanLevelsContour = linspace(meanMinValue, meanMaxValue, num=meanLevels)            
-                mean_data_0 =  ds2.sossheig[timestep_index,:,:]
-                mean_data = mean_data_0.values            
-                mean_colormesh = ax.contour(xxx, yyy, mean_data, cmap=cmap, levels=meanLevelsContour, linewidths=0.2, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
-                
+                with timed("read") as t:
+                    mean_data =  ds2.sossheig[timestep_index,:,:].values
+                    t["bytes"] = mean_data.nbytes
+                with timed("contour"):
+                    mean_colormesh = ax.contour(xxx, yyy, mean_data, cmap=cmap, levels=meanLevelsContour, linewidths=0.2, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
+
                 # colorbar MEAN
-                meanTicks = range(int(meanMinValue), int(meanMaxValue)+1)
-                mean_cb = bmap.colorbar(mean_colormesh, ticks=meanTicks, location="right", shrink=0.2)
-                mean_cb.set_label("Mean ssh (m)", fontsize=5)
-                for t in mean_cb.ax.get_yticklabels():
-                    t.set_fontsize(3)
-                
+                with timed("colorbar"):
+                    meanTicks = range(int(meanMinValue), int(meanMaxValue)+1)
+                    mean_cb = bmap.colorbar(mean_colormesh, ticks=meanTicks, location="right", shrink=0.2)
+                    mean_cb.set_label("Mean ssh (m)", fontsize=5)
+                    for t in mean_cb.ax.get_yticklabels():
+                        t.set_fontsize(3)
+
                 # title
                 # finalDate = "%s:30" % (d3.split(":")[0])
                 finalDate = d1
                 plt.title("Ensemble mean for ssh\nDaily mean: %s" % (finalDate), fontsize = 5)
-                                
-                # draw coastlines, country boundaries, fill continents.
-                bmap.drawcoastlines(linewidth=0.15)
-                bmap.fillcontinents()
-                bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
+
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.15, landColor="0.8", cachePath=cachePath)
 
             else:
-                
+
                 ############################################
                 #
                 # Std
@@ -236,9 +225,8 @@ if __name__ == "__main__":
                 ############################################
 
                 # initialise the map
-                bmap = Basemap(resolution=resolution,
-                               llcrnrlon=lons[0],llcrnrlat=lats[0],
-                               urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
 
                 # customise the colormap
                 max_percentage = 100
@@ -251,49 +239,130 @@ if __name__ == "__main__":
                 newcmp = ListedColormap(fv)
 
                 # get the data
-                std_data_0 =  ds1.sossheig[timestep_index,:,:]
-                std_data_1 = std_data_0.where((std_data_0.lat <= blackSeaMaskLat) | (std_data_0.lon <= blackSeaMaskLon))     
-                std_data = std_data_1.values
-                
-                # determine adaptive min/max
-                stdMinValue = numpy.nanmin(std_data_1.values)
-                stdMaxValue = numpy.nanmax(std_data_1.values)
+                with timed("read") as t:
+                    std_data_0 =  ds1.sossheig[timestep_index,:,:].values
+                    t["bytes"] = std_data_0.nbytes
+                with timed("mask"):
+                    std_data = apply_mask(std_data_0, blackSeaMask)
+
+                # determine adaptive min/max (the configured ones when the
+                # whole slice is masked)
+                with timed("minmax"):
+                    stdMinValue, stdMaxValue = frame_range(std_data)
+                if not numpy.isfinite(stdMinValue):
+                    stdMinValue = configParser.getfloat("ssh", "stdMinValue")
+                    stdMaxValue = configParser.getfloat("ssh", "stdMaxValue")
                 print(stdMinValue)
                 print(stdMaxValue)
-                
+
                 # contourf STD
                 stdLevelsContourf = linspace(stdMinValue, stdMaxValue, num=stdLevels)
                 # std_colormesh = ax.contourf(xxx, yyy, std_data, cmap=newcmp, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue)
-                std_colormesh = ax.contourf(xxx, yyy, std_data, cmap=stdColorMap, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue)
+                with timed(renderEngine):
+                    if renderEngine == "raster":
+                        std_colormesh = draw_raster(ax, xxx, yyy, std_data, stdColorMap, stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue, extend="neither")
+                    else:
+                        std_colormesh = ax.contourf(xxx, yyy, std_data, cmap=stdColorMap, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue)
 
                 # colorbar STD
-                stdTicks = numpy.arange(stdMinValue, stdMaxValue+0.05, 0.05)
-                std_cb = bmap.colorbar(std_colormesh, location='right', shrink = 0.5, ticks = stdTicks)
-                std_cb.set_label("Spread (m)", fontsize=5)
-                for t in std_cb.ax.get_yticklabels():
-                    t.set_fontsize(3)
+                with timed("colorbar"):
+                    stdTicks = numpy.arange(stdMinValue, stdMaxValue+0.05, 0.05)
+                    std_cb = bmap.colorbar(std_colormesh, location='right', shrink = 0.5, ticks = stdTicks)
+                    std_cb.set_label("Spread (m)", fontsize=5)
+                    for t in std_cb.ax.get_yticklabels():
+                        t.set_fontsize(3)
 
                 # title
                 # finalDate = "%s:30" % (d3.split(":")[0])
                 finalDate = d1
                 plt.title("Ensemble spread for ssh\nDaily mean: %s" % (finalDate), fontsize = 5)
-                                
-                # draw coastlines, country boundaries, fill continents.
-                bmap.drawcoastlines(linewidth=0.15)
-                bmap.fillcontinents()
-                bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                                
+
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.15, landColor="0.8", cachePath=cachePath)
+
             ax_index += 1
-                
-        # save file
+
+        # save the combined figure and, when configured, the mean and the
+        # spread panels (with their colorbars) cut from the same raster
         filename = os.path.join(dst, outputFileTemplate.format(DATE=d4))
-        plt.savefig(filename, dpi=300, bbox_inches="tight")
-        print("File %s generated" % filename)
+        outputs = [(filename, None)]
+        if outputMeanTemplate:
+            outputs.append((os.path.join(dst, outputMeanTemplate.format(DATE=d4)), [axes.flat[0], mean_cb.ax]))
+        if outputSpreadTemplate:
+            outputs.append((os.path.join(dst, outputSpreadTemplate.format(DATE=d4)), [axes.flat[1], std_cb.ax]))
+        with timed("savefig") as t:
+            written = save_crops(fig, outputs, dpi=300, resolutions=outputResolutions)
+            t["bytes"] = sum(os.path.getsize(output) for output in written)
+        for output in written:
+            print("File %s generated" % output)
 
         # clear memory
         fig.clear()
         plt.close(fig)
+        end_frame(filename)
+
+        return written
+
+    # skip the frames already rendered from the same inputs (resume mode)
+    return track_frames(configParser, "ssh", [meanFile, stdFile], dst, render_frame, frames, dayIndices)
+
+
+# render all the frames, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderFrame, frames = prepare_frames(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    return run_frames(renderFrame, frames, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################    
+    
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all")
+    days = None
+    try:
+        days = parse_days(sys.argv[3])
+    except IndexError:
+        days = [0]
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+    print("[%s] -- Days set to: %s" % (appname, "all" if days is None else days))
+
         
-        # increment timestep index
-        timestep_index += 1
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+        
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
@@ -6,22 +6,28 @@
 #
 ###############################################
 
-from matplotlib.colors import ListedColormap, LinearSegmentedColormap
-from mpl_toolkits.basemap import Basemap
+from matplotlib.colors import ListedColormap
+from background_layer import draw_background
+from frame_pool import run_frames
+from basemap_cache import get_basemap
+from dataset_loader import open_dataset, lazy_loading
+from slice_store import slice_store
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import track_frames
+from panel_raster import save_crops, output_resolutions
+from raster_engine import render_engine, draw_raster
+from masks import black_sea_mask, apply_mask
+from frame_stats import frame_range
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
 import matplotlib.pyplot as plt
 from numpy import meshgrid
 from numpy import linspace
 from matplotlib import cm
 import configparser
 import numpy as np
-import matplotlib
-import traceback
 import datetime
 import warnings
-import xarray
 import numpy
-import math
-import pdb
 import sys
 import os
 
@@ -40,50 +46,20 @@ appname = "PlotTemperature"
 
 ###############################################
 #
-# main
+# frames preparation
 #
 ###############################################
 
-if __name__ == "__main__":
-
-    ###############################################
-    #
-    # read input parameters
-    #
-    ###############################################    
-    
-    # read config file name
-    configFile = None
-    try:
-        configFile = sys.argv[1]
-    except:
-        print("[ERROR] -- Config file not provided!")
-        sys.exit(1)
-
-    # read date
-    inputDate = None
-    try:
-        inputDate = sys.argv[2]
-    except:
-        inputDate = datetime.datetime.today().strftime("%Y%m%d")
-
-    # read day index
-    day_index = None
-    try:
-        day_index = int(sys.argv[3])
-    except:
-        day_index = 0
+# read the configuration, open the datasets and return the function
+# rendering a single frame, along with the list of frames to render
+def prepare_frames(configParser, inputDate, days=None):
 
-        
     ###############################################
     #
     # parse config file
     #
     ###############################################
         
-    configParser = configparser.ConfigParser()
-    configParser.read(configFile)
-
     # paths
     basePath = configParser.get("default", "basePath")
     baseOutputPath = configParser.get("default", "baseOutputPath")    
@@ -91,6 +67,9 @@ if __name__ == "__main__":
     stdFile = os.path.join(basePath, inputDate, configParser.get("temperature", "stdFile"))
     outputFolder = configParser.get("temperature", "outputFolder")
     outputFileTemplate = configParser.get("temperature", "outputName")
+    outputMeanTemplate = configParser.get("temperature", "outputMeanName", fallback=None)
+    outputSpreadTemplate = configParser.get("temperature", "outputSpreadName", fallback=None)
+    outputResolutions = output_resolutions(configParser, "temperature")
     print("[%s] -- Mean file set to: %s" % (appname, meanFile))
     print("[%s] -- Std file set to: %s" % (appname, stdFile))
 
@@ -99,6 +78,7 @@ if __name__ == "__main__":
     if not os.path.exists(dst):
         os.makedirs(dst, exist_ok=True)
     print("[%s] -- Output folder set to: %s" % (appname, dst))
+    print("[%s] -- Additional resolutions set to: %s" % (appname, outputResolutions))
 
     # black sea mask
     blackSeaMaskLat = configParser.getfloat("default", "blackSeaMaskLat")
@@ -134,6 +114,11 @@ if __name__ == "__main__":
     stdColorMap = configParser.get("temperature", "stdColorMap")
     stdLevels = configParser.getint("temperature", "stdLevels")    
     resolution = configParser.get("temperature", "resolution")
+    cachePath = configParser.get("default", "cachePath", fallback=None)
+    backgroundLayer = configParser.get("default", "backgroundLayer", fallback="vector")
+    renderEngine = render_engine(configParser, "temperature")
+    lazyLoading = lazy_loading(configParser, "temperature")
+    sliceStore = slice_store(configParser, "temperature", inputDate)
     print("[%s] -- Mean color map set to: %s" % (appname, meanColorMap))
     print("[%s] -- Mean min values (surf) set to: %s" % (appname, meanMinValues_surf))
     print("[%s] -- Mean max values (surf) set to: %s" % (appname, meanMaxValues_surf))
@@ -145,6 +130,12 @@ if __name__ == "__main__":
     print("[%s] -- Std min values (bott) set to: %s" % (appname, stdMinValues_bott))
     print("[%s] -- Std max values (bott) set to: %s" % (appname, stdMaxValues_bott))    
     print("[%s] -- Resolution set to: %s" % (appname, resolution))
+    print("[%s] -- Cache path set to: %s" % (appname, cachePath))
+    print("[%s] -- Background layer mode set to: %s" % (appname, backgroundLayer))
+    print("[%s] -- Render engine set to: %s" % (appname, renderEngine))
+    init_timings(configParser)
+    print("[%s] -- Lazy loading set to: %s" % (appname, lazyLoading))
+    print("[%s] -- Slice store set to: %s" % (appname, sliceStore))
 
     
     ###############################################
@@ -154,10 +145,13 @@ if __name__ == "__main__":
     ###############################################
     
     # open dataset STD    
-    ds1 = xarray.open_dataset(stdFile)
+    set_frame("temperature", inputDate)
+    with timed("open"):
+        ds1 = open_dataset(stdFile, lazyLoading, sliceStore, ["votemper"])
 
     # open dataset MEAN
-    ds2 = xarray.open_dataset(meanFile)
+    with timed("open"):
+        ds2 = open_dataset(meanFile, lazyLoading, sliceStore, ["votemper"])
     
     # grid indices
     x = ds1.lon.values
@@ -174,182 +168,245 @@ if __name__ == "__main__":
     # create the grid
     xxx, yyy = meshgrid(lons, lats)
 
-    # define a timestep index (to keep track of the timesteps) and an index to keep track of the day we are in
-    timestep_index = 0
-    day_current_index = 0
-    old_day = str(ds1.time[0].values).split("T")[0]
-    
-    # iterate over the timestamps
-    for t in ds1.time.values:
+    # the black sea mask only depends on the grid, build it once
+    blackSeaMask = black_sea_mask(yyy, xxx, blackSeaMaskLat, blackSeaMaskLon)
 
-        # get the date of the current timestep, and optionally update the variable and index keeping track of the day
-        d1 = str(t).split("T")[0]
-        if d1 != old_day:
-            old_day = d1
-            day_current_index += 1
+    # map the requested days straight to their timesteps and compute the
+    # date labels of all the timesteps at once
+    timesteps = timesteps_for_days(ds1.time.values, days)
+    dates, months, hours = timestep_labels(ds1.time.values)
+    uniqueDays, dayIndices = day_groups(ds1.time.values)
 
-        # get days string
-        d1 = str(t).split("T")[0]
+    # collect the frames (timestep and depth indices) of the requested days
+    frames = [(int(timestep_index), depth_index) for timestep_index in timesteps for depth_index in range(len(ds1.depth.values))]
 
-        print(d1)
-        
-        month = str(int(d1.split("-")[1]))
-        hour = str(t).split("T")[1].split(":")[0]
-        minu = str(t).split("T")[1].split(":")[1]
-        d2 = "%s:%s" % (hour, minu)
-        d3 = "%s, %s" % (d1, d2)
-        d4 = "%s_%s30" % (d1, hour)
+    # render a frame
+    def render_frame(frame):
 
-        # check if it's the desired day, otherwise move on
-        if day_current_index != day_index:
-            timestep_index += 1
-            continue
-        
-        # iterate over depth
-        depth_index = 0
-        for d in ds1.depth.values:
-
-            fig, axes = plt.subplots(nrows=2, ncols=1)
-            
-            ax_index = 0
-            for ax in axes.flat:
-                    
-                if depth_index < 2:
-                    meanMinValue = meanMinValues_surf[int(month)+1]
-                    meanMaxValue = meanMaxValues_surf[int(month)+1]
-                    stdMinValue = stdMinValues_surf[int(month)+1]
-                    stdMaxValue = stdMaxValues_surf[int(month)+1]       
-                else:
-                    meanMinValue = meanMinValues_bott[int(month)+1]
-                    meanMaxValue = meanMaxValues_bott[int(month)+1]
-                    stdMinValue = stdMinValues_bott[int(month)+1]
-                    stdMaxValue = stdMaxValues_bott[int(month)+1]       
-                
-                if ax_index == 0:
-
-                    # meanMinValue = numpy.min(ds2.votemper[timestep_index,depth_index,:,:])
-                    # meanMaxValue = numpy.max(ds2.votemper[timestep_index,depth_index,:,:])
-                    
-                    ############################################
-                    #
-                    # Mean
-                    #
-                    ############################################                                            
-                
-                    # initialise the map
-                    bmap = Basemap(resolution=resolution,
-                                   llcrnrlon=lons[0],llcrnrlat=lats[0],
-                                   urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
-        
-                    # customize colormap
-                    min_val, max_val = 0, 0.7
-                    n = 10            
-                    orig_cmap = cm.gist_rainbow
-                    colors = orig_cmap(np.linspace(min_val, max_val, n))
-                    cmap = cm.colors.LinearSegmentedColormap.from_list("mycmap", colors)
-                    cmap = meanColorMap
-
-                    # set adaptive min and max
-                    meanMinValue = numpy.nanmin(ds2.votemper[timestep_index,depth_index,:,:])
-                    meanMaxValue = numpy.nanmax(ds2.votemper[timestep_index,depth_index,:,:])
-                    
-                    # get the mean -- part 1                
-                    mean_data_0 =  ds2.votemper[timestep_index,depth_index,:,:]
-                    mean_data_1 = mean_data_0.where(mean_data_0 > 0, other=np.nan)
-                  
-                    # get the mean -- mask the black sea -- part 2
-                    mean_data_2 = mean_data_1.where((mean_data_1['lat'] <= blackSeaMaskLat) | (mean_data_1['lon'] <= blackSeaMaskLon), np.nan)                    
-                    mean_data = mean_data_2.values
-
-                    # set adaptive min and max
-                    meanMinValue = numpy.nanmin(mean_data_2.values)
-                    meanMaxValue = numpy.nanmax(mean_data_2.values)
-                    
-                    # contour range
-                    meanLevelsContour = linspace(meanMinValue, meanMaxValue, num=meanLevels)            
-                    
-                    mean_colormesh = bmap.contourf(xxx, yyy, mean_data, cmap=cmap, levels=meanLevelsContour, linewidths=0.15, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
-                    
-                    # colorbar MEAN
+        timestep_index, depth_index = frame
+        d = ds1.depth.values[depth_index]
+
+        # get days string
+        d1 = dates[timestep_index]
+        month = months[timestep_index]
+        hour = hours[timestep_index]
+        d4 = "%s_%s30" % (d1, hour)
+        set_frame("temperature", d1, dayIndices[timestep_index], d)
+
+        fig, axes = plt.subplots(nrows=2, ncols=1)
+
+        ax_index = 0
+        for ax in axes.flat:
+
+            if depth_index < 2:
+                meanMinValue = meanMinValues_surf[int(month)+1]
+                meanMaxValue = meanMaxValues_surf[int(month)+1]
+                stdMinValue = stdMinValues_surf[int(month)+1]
+                stdMaxValue = stdMaxValues_surf[int(month)+1]       
+            else:
+                meanMinValue = meanMinValues_bott[int(month)+1]
+                meanMaxValue = meanMaxValues_bott[int(month)+1]
+                stdMinValue = stdMinValues_bott[int(month)+1]
+                stdMaxValue = stdMaxValues_bott[int(month)+1]       
+
+            if ax_index == 0:
+
+                # meanMinValue = numpy.min(ds2.votemper[timestep_index,depth_index,:,:])
+                # meanMaxValue = numpy.max(ds2.votemper[timestep_index,depth_index,:,:])
+
+                ############################################
+                #
+                # Mean
+                #
+                ############################################                                            
+
+                # initialise the map
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
+
+                # customize colormap
+                min_val, max_val = 0, 0.7
+                n = 10            
+                orig_cmap = cm.gist_rainbow
+                colors = orig_cmap(np.linspace(min_val, max_val, n))
+                cmap = cm.colors.LinearSegmentedColormap.from_list("mycmap", colors)
+                cmap = meanColorMap
+
+                # get the mean -- mask land and black sea
+                with timed("read") as t:
+                    mean_data_0 =  ds2.votemper[timestep_index,depth_index,:,:].values
+                    t["bytes"] = mean_data_0.nbytes
+                with timed("mask"):
+                    mean_data = apply_mask(mean_data_0, blackSeaMask, positive=True)
+
+                # set adaptive min and max (keep the configured ones when the
+                # whole slice is masked, e.g. a deep level)
+                with timed("minmax"):
+                    dataMinValue, dataMaxValue = frame_range(mean_data)
+                if numpy.isfinite(dataMinValue):
+                    meanMinValue, meanMaxValue = dataMinValue, dataMaxValue
+
+                # contour range
+                meanLevelsContour = linspace(meanMinValue, meanMaxValue, num=meanLevels)            
+
+                with timed(renderEngine):
+                    if renderEngine == "raster":
+                        mean_colormesh = draw_raster(ax, xxx, yyy, mean_data, cmap, meanLevelsContour, vmin=meanMinValue, vmax=meanMaxValue)
+                    else:
+                        mean_colormesh = bmap.contourf(xxx, yyy, mean_data, cmap=cmap, levels=meanLevelsContour, linewidths=0.15, vmin=meanMinValue, vmax=meanMaxValue, extend='both')
+
+                # colorbar MEAN
+                with timed("colorbar"):
                     meanTicks = range(int(meanMinValue), int(meanMaxValue)+1)
                     mean_cb = bmap.colorbar(mean_colormesh, ticks=meanTicks, location='right')
                     mean_cb.set_label("Mean Temperature (degC)", fontsize=5)
                     for t in mean_cb.ax.get_yticklabels():
                         t.set_fontsize(3)
-                    
-                    # draw coastlines, country boundaries, fill continents.
-                    bmap.drawcoastlines(linewidth=0.15)
-                    bmap.fillcontinents()
-                    bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                    bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-
-                    # title
-                    # finalDate = "%s:30" % (d3.split(":")[0])
-                    finalDate = d1
-                    plt.title("Ensemble mean for Sea temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
-                    
-                else:
-                        
-                    ############################################
-                    #
-                    # Std
-                    #
-                    ############################################                                            
-    
-                    # initialise the map
-                    bmap = Basemap(resolution=resolution,
-                                   llcrnrlon=lons[0],llcrnrlat=lats[0],
-                                   urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)
-        
-                    # define the colormap
-                    max_percentage = 100
-                    white_percentage = 20
-                    white = np.array([256/256, 256/256, 256/256, 1])
-                    reds = cm.get_cmap(stdColorMap, 256)
-                    fv = reds(np.linspace(0, 1, max_percentage))
-                    fv[:white_percentage, :] = white
-                    fv[white_percentage:, :] = reds(np.linspace(0, 1, max_percentage-white_percentage))
-                    newcmp = ListedColormap(fv)
-
-                    # contourf STD
-                    stdLevelsContourf = linspace(stdMinValue, stdMaxValue, num=stdLevels+1)
-                    std_data_0 =  ds1.votemper[timestep_index,depth_index,:,:]
-                    std_data_1 = std_data_0.where((std_data_0.lat <= blackSeaMaskLat) | (std_data_0.lon <= blackSeaMaskLon))
-                    std_data = std_data_1.values
-                    std_colormesh = bmap.contourf(xxx, yyy, std_data, cmap=newcmp, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue, extend='both')
-                        
-                    # colorbar STD
+
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.15, landColor="0.8", cachePath=cachePath)
+
+                # title
+                # finalDate = "%s:30" % (d3.split(":")[0])
+                finalDate = d1
+                plt.title("Ensemble mean for Sea temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
+
+            else:
+
+                ############################################
+                #
+                # Std
+                #
+                ############################################                                            
+
+                # initialise the map
+                with timed("basemap"):
+                    bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)
+
+                # define the colormap
+                max_percentage = 100
+                white_percentage = 20
+                white = np.array([256/256, 256/256, 256/256, 1])
+                reds = cm.get_cmap(stdColorMap, 256)
+                fv = reds(np.linspace(0, 1, max_percentage))
+                fv[:white_percentage, :] = white
+                fv[white_percentage:, :] = reds(np.linspace(0, 1, max_percentage-white_percentage))
+                newcmp = ListedColormap(fv)
+
+                # contourf STD
+                stdLevelsContourf = linspace(stdMinValue, stdMaxValue, num=stdLevels+1)
+                with timed("read") as t:
+                    std_data_0 =  ds1.votemper[timestep_index,depth_index,:,:].values
+                    t["bytes"] = std_data_0.nbytes
+                with timed("mask"):
+                    std_data = apply_mask(std_data_0, blackSeaMask)
+                with timed(renderEngine):
+                    if renderEngine == "raster":
+                        std_colormesh = draw_raster(ax, xxx, yyy, std_data, newcmp, stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue)
+                    else:
+                        std_colormesh = bmap.contourf(xxx, yyy, std_data, cmap=newcmp, levels=stdLevelsContourf, vmin=stdMinValue, vmax=stdMaxValue, extend='both')
+
+                # colorbar STD
+                with timed("colorbar"):
                     stdTicks = numpy.arange(stdMinValue, stdMaxValue+0.1, 0.1)
                     std_cb = bmap.colorbar(std_colormesh, location='right', ticks = stdTicks, shrink = 0.5)
                     std_cb.set_label("Spread (degC)", fontsize=5)
                     for t in std_cb.ax.get_yticklabels():
                         t.set_fontsize(3)
-                            
-                    # title
-                    # finalDate = "%s:30" % (d3.split(":")[0])
-                    finalDate = d1
-                    plt.title("Ensemble spread for Sea temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
-                    
-                    # draw coastlines, country boundaries, fill continents.
-                    bmap.drawcoastlines(linewidth=0.15)
-                    bmap.fillcontinents()
-                    bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                    bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
+
+                # title
+                # finalDate = "%s:30" % (d3.split(":")[0])
+                finalDate = d1
+                plt.title("Ensemble spread for Sea temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
+
+                # draw coastlines, fill continents and graticule
+                with timed("background"):
+                    draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.15, landColor="0.8", cachePath=cachePath)
+
+            ax_index += 1
+
+        # save the combined figure and, when configured, the mean and the
+        # spread panels (with their colorbars) cut from the same raster
+        di = ds1.depth.values.tolist().index(d)
+        filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))
+        outputs = [(filename, None)]
+        if outputMeanTemplate:
+            outputs.append((os.path.join(dst, outputMeanTemplate.format(DATE=d4, DEPTH=di)), [axes.flat[0], mean_cb.ax]))
+        if outputSpreadTemplate:
+            outputs.append((os.path.join(dst, outputSpreadTemplate.format(DATE=d4, DEPTH=di)), [axes.flat[1], std_cb.ax]))
+        with timed("savefig") as t:
+            written = save_crops(fig, outputs, dpi=300, resolutions=outputResolutions)
+            t["bytes"] = sum(os.path.getsize(output) for output in written)
+        for output in written:
+            print("File %s generated" % output)
+
+        # clear memory
+        fig.clear()
+        plt.close(fig)
+        end_frame(filename)
+
+        return written
+
+    # skip the frames already rendered from the same inputs (resume mode)
+    return track_frames(configParser, "temperature", [meanFile, stdFile], dst, render_frame, frames, dayIndices)
+
+
+# render all the frames, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderFrame, frames = prepare_frames(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    return run_frames(renderFrame, frames, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################    
     
-                ax_index += 1
-                    
-            # save file
-            di = ds1.depth.values.tolist().index(d)
-            filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))            
-            plt.savefig(filename, dpi=300, bbox_inches="tight")
-            print("File %s generated" % filename)
-
-            # clear memory
-            fig.clear()
-            plt.close(fig)
-                       
-            # increment depth_index
-            depth_index += 1
-
-        # increment timestep index
-        timestep_index += 1
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all")
+    days = None
+    try:
+        days = parse_days(sys.argv[3])
+    except IndexError:
+        days = [0]
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+    print("[%s] -- Days set to: %s" % (appname, "all" if days is None else days))
+
+        
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+        
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
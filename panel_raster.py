@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.transforms import Bbox
+from PIL import Image
+import numpy
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "PanelRaster"
+
+
+###############################################
+#
+# figure raster
+#
+###############################################
+
+# draw a figure once into an RGBA raster at the given resolution. Returns
+# the raster along with the renderer, to locate the artists on it
+def render_raster(fig, dpi):
+    canvas = FigureCanvasAgg(fig)
+    fig.set_dpi(dpi)
+    canvas.draw()
+    return numpy.asarray(canvas.buffer_rgba()), canvas.get_renderer()
+
+
+# pixel box (rows and columns of the raster) holding some artists, e.g. a
+# panel and its colorbar, or the whole figure when artists is None, with a
+# padding in inches like savefig(bbox_inches="tight")
+def crop_box(fig, renderer, artists=None, pad=0.1):
+    if artists is None:
+        bbox = fig.get_tightbbox(renderer).transformed(fig.dpi_scale_trans)
+    else:
+        bbox = Bbox.union([artist.get_tightbbox(renderer) for artist in artists])
+    bbox = bbox.padded(pad * fig.dpi)
+    width, height = fig.canvas.get_width_height()
+    x0, x1 = max(int(numpy.floor(bbox.x0)), 0), min(int(numpy.ceil(bbox.x1)), width)
+    y0, y1 = max(int(numpy.floor(height - bbox.y1)), 0), min(int(numpy.ceil(height - bbox.y0)), height)
+    return slice(y0, y1), slice(x0, x1)
+
+
+###############################################
+#
+# output resolutions
+#
+###############################################
+
+# parse the additional resolutions of the outputs ("web:96, thumb:24"):
+# a list of (suffix, dpi) pairs
+def parse_resolutions(value):
+    resolutions = []
+    for item in (value or "").split(","):
+        if item.strip():
+            suffix, dpi = item.split(":")
+            resolutions.append((suffix.strip(), int(dpi)))
+    return resolutions
+
+
+# read the outputResolutions option of a section, falling back to the
+# default section
+def output_resolutions(configParser, section):
+    return parse_resolutions(configParser.get(section, "outputResolutions",
+                                              fallback=configParser.get("default", "outputResolutions", fallback="")))
+
+
+# name of an output at an additional resolution (image.png -> image_web.png)
+def suffixed_name(filename, suffix):
+    root, ext = os.path.splitext(filename)
+    return "%s_%s%s" % (root, suffix, ext)
+
+
+###############################################
+#
+# outputs
+#
+###############################################
+
+# render a figure once and save the images cut from it: outputs is a list
+# of (filename, artists) pairs, with artists None for the whole figure.
+# Each image is also downsampled to the additional resolutions, written
+# with suffixed names. Returns the names of the files written
+def save_crops(fig, outputs, dpi=300, pad=0.1, resolutions=()):
+    raster, renderer = render_raster(fig, dpi)
+    written = []
+    for filename, artists in outputs:
+        rows, cols = crop_box(fig, renderer, artists, pad)
+        image = Image.fromarray(raster[rows, cols])
+        image.save(filename, dpi=(dpi, dpi))
+        written.append(filename)
+        for suffix, lowDpi in resolutions:
+            size = (max(int(round(image.width * lowDpi / dpi)), 1), max(int(round(image.height * lowDpi / dpi)), 1))
+            image.resize(size, Image.LANCZOS).save(suffixed_name(filename, suffix), dpi=(lowDpi, lowDpi))
+            written.append(suffixed_name(filename, suffix))
+    return written
@@ -7,19 +7,26 @@
 #
 ###############################################
 
-from mpl_toolkits.basemap import Basemap
+from background_layer import draw_background
+from frame_pool import run_frames
+from basemap_cache import get_basemap
+from dataset_loader import member_files, open_ensemble
+from slice_store import slice_store
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import track_frames
+from panel_raster import save_crops, output_resolutions
+from raster_engine import render_engine, draw_raster
+from streamlines import get_streamlines, draw_streamlines
+from vector_arrows import vector_mode, draw_quiver
+from derived_fields import read_currents
+from masks import black_sea_mask, apply_mask
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
 import matplotlib.pyplot as plt
 from numpy import meshgrid
 from numpy import linspace
 import configparser
-import numpy as np
-import traceback
 import datetime
 import warnings
-import xarray
-import numpy
-import math
-import pdb
 import sys
 import os
 
@@ -37,54 +44,29 @@ appname = "PlotPostageCurr"
 
 ###############################################
 #
-# main
+# frames preparation
 #
 ###############################################
 
-if __name__ == "__main__":
-
-    ###############################################
-    #
-    # read input parameters
-    #
-    ###############################################    
-    
-    # read config file name
-    configFile = None
-    try:
-        configFile = sys.argv[1]
-    except:
-        print("[ERROR] -- Config file not provided!")
-        sys.exit(1)
-
-    # read date
-    inputDate = None
-    try:
-        inputDate = sys.argv[2]
-    except:
-        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+# read the configuration, open the datasets and return the function
+# rendering a single frame, along with the list of frames to render
+def prepare_frames(configParser, inputDate, days=None):
 
-        
     ###############################################
     #
     # parse config file
     #
     ###############################################
         
-    configParser = configparser.ConfigParser()
-    configParser.read(configFile)
-
     # paths
-    baseEnsPathTemplate = configParser.get("default", "baseEnsPath")
     baseOutputPath = configParser.get("default", "baseOutputPath")    
-    inputFileTemplateU = configParser.get("postcardCurrents", "inputFile")
-    inputFilesU = []
     outputFolder = configParser.get("postcardCurrents", "outputFolder")
     outputFileTemplate = configParser.get("postcardCurrents", "outputName")
+    outputResolutions = output_resolutions(configParser, "postcardCurrents")
+    inputFilesU = member_files(configParser, "postcardCurrents", inputDate)
+    members = len(inputFilesU)
     print("[%s] -- Input files set to:" % (appname))
-    for i in range(10):
-        inputFileU = os.path.join(baseEnsPathTemplate.format(INSTANCE=i, DATE=inputDate), inputFileTemplateU.format(DATE=inputDate))        
-        inputFilesU.append(inputFileU)
+    for inputFileU in inputFilesU:
         print(inputFileU)
         
     # create output folder if needed
@@ -92,6 +74,7 @@ if __name__ == "__main__":
     if not os.path.exists(dst):
         os.makedirs(dst, exist_ok=True)
     print("[%s] -- Output folder set to: %s" % (appname, dst))
+    print("[%s] -- Additional resolutions set to: %s" % (appname, outputResolutions))
 
     # black sea mask
     blackSeaMaskLat = configParser.getfloat("default", "blackSeaMaskLat")
@@ -100,11 +83,24 @@ if __name__ == "__main__":
 
     # chart details
     resolution = configParser.get("postcardCurrents", "resolution")
+    cachePath = configParser.get("default", "cachePath", fallback=None)
+    backgroundLayer = configParser.get("default", "backgroundLayer", fallback="vector")
+    renderEngine = render_engine(configParser, "postcardCurrents")
+    vectorMode, quiverSpacing = vector_mode(configParser, "postcardCurrents")
+    cacheStreamlines = configParser.getboolean("postcardCurrents", "cacheStreamlines", fallback=configParser.getboolean("default", "cacheStreamlines", fallback=False))
     colorMap = configParser.get("postcardCurrents", "colorMap")
     minValue = configParser.getfloat("postcardCurrents", "minValue")
     maxValue = configParser.getfloat("postcardCurrents", "maxValue")
     levels = configParser.getint("postcardCurrents", "levels")
     print("[%s] -- Resolution set to: %s" % (appname, resolution))
+    print("[%s] -- Cache path set to: %s" % (appname, cachePath))
+    print("[%s] -- Background layer mode set to: %s" % (appname, backgroundLayer))
+    print("[%s] -- Render engine set to: %s" % (appname, renderEngine))
+    print("[%s] -- Streamline cache set to: %s" % (appname, cacheStreamlines))
+    print("[%s] -- Vector mode set to: %s (quiver spacing %s px)" % (appname, vectorMode, quiverSpacing))
+    sliceStore = slice_store(configParser, "postcardCurrents", inputDate)
+    print("[%s] -- Slice store set to: %s" % (appname, sliceStore))
+    init_timings(configParser)
     print("[%s] -- Min Value set to: %s" % (appname, minValue))
     print("[%s] -- Max Value set to: %s" % (appname, maxValue))
     print("[%s] -- Color map set to: %s" % (appname, colorMap))
@@ -117,105 +113,184 @@ if __name__ == "__main__":
     #
     ###############################################
 
-    # open files
-    datasetsU = []
-    for i in inputFilesU:
-        datasetsU.append(xarray.open_dataset(i))
+    # open the member files as a single (member, time, depth, lat, lon) cube
+    set_frame("postcardCurrents", inputDate)
+    with timed("open"):
+        cube = open_ensemble(inputFilesU, ["vozocrtx", "vomecrty"], sliceStore)
 
     # grid indices
-    x = datasetsU[0].nav_lon.transpose().values[0]
-    y = datasetsU[0].nav_lat.values[0]
+    x = cube.nav_lon.transpose().values[0]
+    y = cube.nav_lat.values[0]
 
     # lats and lons
-    lats = datasetsU[0].nav_lat.transpose().values[0]
-    lons = datasetsU[0].nav_lon.values[0]
+    lats = cube.nav_lat.transpose().values[0]
+    lons = cube.nav_lon.values[0]
 
     # create the grid
     xxx, yyy = meshgrid(lons, lats)
 
-    # define a timestep index (to keep track of the timesteps) and an index to keep track of the day we are in
-    timestep_index = 0
-    day_current_index = 0
-    old_day = str(datasetsU[0].time_counter[0].values).split("T")[0]
-    
-    # iterate over timesteps
-    timestep_index = 0
-    for t in datasetsU[0].time_counter:
+    # the black sea mask only depends on the grid, build it once
+    blackSeaMask = black_sea_mask(yyy, xxx, blackSeaMaskLat, blackSeaMaskLon)
+
+    # map the requested days (all by default) straight to their timesteps
+    # and compute the dates of all the timesteps at once
+    timesteps = timesteps_for_days(cube.time_counter.values, days)
+    dates, months, hours = timestep_labels(cube.time_counter.values)
+    uniqueDays, dayIndices = day_groups(cube.time_counter.values)
 
-        # get the date of the current timestep, and optionally update the variable and index keeping track of the day
-        d1 = str(t.values).split("T")[0]
-        if d1 != old_day:
-            old_day = d1
-            day_current_index += 1
+    # collect the frames (timestep and depth indices)
+    frames = [(int(timestep_index), depth_index) for timestep_index in timesteps for depth_index in range(len(cube.depthu))]
+
+    # render a frame
+    def render_frame(frame):
+
+        timestep_index, depth_index = frame
+        d = cube.depthu[depth_index]
 
         # get days string
-        d1 = str(t.values).split("T")[0]        
+        d1 = dates[timestep_index]
         d3 = "%s, 12:30" % (d1)
         d4 = "%s_1230" % (d1)
-        # d4 = d1
 
         # debug print
         print("[%s] -- Timestep: %s" % (appname, d3))
+        set_frame("postcardCurrents", d1, dayIndices[timestep_index], d)
 
-        # iterate over depth
-        depth_index = 0
-        for d in datasetsU[0].depthu:
-
-            fig, axes = plt.subplots(nrows=5, ncols=2)
-            
-            ax_index = 0
-            for ax in axes.flat:
-
-                # create basemap
-                bmap = Basemap(resolution=resolution,
-                               llcrnrlon=lons[0],llcrnrlat=lats[0],
-                               urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)                
-
-                # contourf
-                mean_data_0u = datasetsU[ax_index].vozocrtx[timestep_index,depth_index,:,:]
-                mean_data_0v = datasetsU[ax_index].vomecrty[timestep_index,depth_index,:,:]                
-                mean_data_u = mean_data_0u.where(((mean_data_0u.nav_lat <= blackSeaMaskLat) | (mean_data_0u.nav_lon <= blackSeaMaskLon)))
-                mean_data_v = mean_data_0v.where(((mean_data_0v.nav_lat <= blackSeaMaskLat) | (mean_data_0v.nav_lon <= blackSeaMaskLon)))
-                mean_data = numpy.sqrt(mean_data_u ** 2 + mean_data_v ** 2)                
-                
-                contour_levels = linspace(minValue, maxValue, levels)
-                im = ax.contourf(xxx, yyy, mean_data, cmap=colorMap, levels=contour_levels, extend='both')
-                ax.set_title("Member %s" % ax_index, fontsize = 5, pad = 4)
+        # read the slice of all the members at once, derive the speed and
+        # mask the black sea
+        with timed("read") as t:
+            currents, t["bytes"] = read_currents(cube, "vozocrtx", cube, "vomecrty", (slice(None), timestep_index, depth_index))
+        members_u = currents["u"]
+        members_v = currents["v"]
+        with timed("mask"):
+            members_data = apply_mask(currents["speed"], blackSeaMask)
+
+        fig, axes = plt.subplots(nrows=(members + 1) // 2, ncols=2)
+
+        ax_index = 0
+        for ax in axes.flat:
+
+            # odd number of members: leave the last panel empty
+            if ax_index >= members:
                 ax.axis('off')
-                ax_index += 1
-
-                # draw coastlines, country boundaries, fill continents.
-                bmap.drawcoastlines(linewidth=0.25)
-                bmap.fillcontinents(color='white')
-                bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-
-                # quiver
-                mean_colormesh = bmap.streamplot(xxx, yyy, mean_data_0u, mean_data_0v, linewidth=0.15, arrowsize=0.15, density=2, color='k')
-                                    
-            # colorbar
+                continue
+
+            # create basemap
+            with timed("basemap"):
+                bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)                
+
+            # contourf
+            mean_data = members_data[ax_index]
+
+            with timed(renderEngine):
+                contour_levels = linspace(minValue, maxValue, levels)
+                if renderEngine == "raster":
+                    im = draw_raster(ax, xxx, yyy, mean_data, colorMap, contour_levels)
+                else:
+                    im = ax.contourf(xxx, yyy, mean_data, cmap=colorMap, levels=contour_levels, extend='both')
+            ax.set_title("Member %s" % ax_index, fontsize = 5, pad = 4)
+            ax.axis('off')
+
+            # draw coastlines, fill continents and graticule
+            with timed("background"):
+                draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.25, landColor="white", cachePath=cachePath)
+
+            # quiver
+            with timed(vectorMode):
+                if vectorMode == "quiver":
+                    mean_colormesh = draw_quiver(ax, xxx, yyy, currents["unitU"][ax_index], currents["unitV"][ax_index], dpi=300, spacing=quiverSpacing, color='k')
+                elif cacheStreamlines:
+                    geometry = get_streamlines(xxx, yyy, members_u[ax_index], members_v[ax_index], 2, cachePath=cachePath)
+                    mean_colormesh = draw_streamlines(bmap, ax, geometry, linewidth=0.15, arrowsize=0.15, color='k')
+                else:
+                    mean_colormesh = bmap.streamplot(xxx, yyy, members_u[ax_index], members_v[ax_index], linewidth=0.15, arrowsize=0.15, density=2, color='k')
+            ax_index += 1
+
+        # colorbar
+        with timed("colorbar"):
             ticks = range(int(minValue), int(maxValue)+1, 1)
             cb = fig.colorbar(im, ax=axes.ravel().tolist(), ticks=ticks, shrink=0.5)
             cb.set_label("Currents (m/s)", fontsize = 3)
             cb.ax.tick_params(labelsize=3)
             for t in cb.ax.get_xticklabels():
                 t.set_fontsize(1)
-            
-            # title
-            finalDate = "%s:30" % (d3.split(":")[0])
-            plt.suptitle("Currents at %s m.\nDaily mean: %s" % (int(d), d1), fontsize = 5)
-                
-            # save file
-            di = datasetsU[0].depthu.values.tolist().index(d)            
-            filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))                    
-            plt.savefig(filename, dpi=300, bbox_inches="tight")
-            print("File %s generated" % filename)
-            
-            fig.clear()
-            plt.close(fig)            
-            
-            # increment depth
-            depth_index += 1
-
-        # increment timestep
-        timestep_index += 1
+
+        # title
+        finalDate = "%s:30" % (d3.split(":")[0])
+        plt.suptitle("Currents at %s m.\nDaily mean: %s" % (int(d), d1), fontsize = 5)
+
+        # save file
+        di = cube.depthu.values.tolist().index(d)            
+        filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))                    
+        with timed("savefig") as t:
+            written = save_crops(fig, [(filename, None)], dpi=300, resolutions=outputResolutions)
+            t["bytes"] = sum(os.path.getsize(output) for output in written)
+        for output in written:
+            print("File %s generated" % output)
+
+        fig.clear()
+        plt.close(fig)            
+        end_frame(filename)
+
+        return written
+
+    # skip the frames already rendered from the same inputs (resume mode)
+    return track_frames(configParser, "postcardCurrents", inputFilesU, dst, render_frame, frames, dayIndices)
+
+
+# render all the frames, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderFrame, frames = prepare_frames(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    return run_frames(renderFrame, frames, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################    
+    
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all",
+    # the default)
+    try:
+        days = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+    print("[%s] -- Days set to: %s" % (appname, "all" if days is None else days))
+
+        
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+        
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
@@ -7,19 +7,24 @@
 #
 ###############################################
 
-from mpl_toolkits.basemap import Basemap
+from background_layer import draw_background
+from frame_pool import run_frames
+from frame_stats import parse_percentiles, frame_range
+from basemap_cache import get_basemap
+from dataset_loader import member_files, open_ensemble
+from slice_store import slice_store
+from instrumentation import init_timings, set_frame, end_frame, timed
+from manifest import track_frames
+from panel_raster import save_crops, output_resolutions
+from raster_engine import render_engine, draw_raster
+from masks import black_sea_mask, apply_mask
+from time_index import parse_days, day_groups, timesteps_for_days, timestep_labels
 import matplotlib.pyplot as plt
 from numpy import meshgrid
 from numpy import linspace
 import configparser
-import numpy as np
-import traceback
 import datetime
 import warnings
-import xarray
-import numpy
-import math
-import pdb
 import sys
 import os
 
@@ -37,54 +42,29 @@ appname = "PlotPostageTemp"
 
 ###############################################
 #
-# main
+# frames preparation
 #
 ###############################################
 
-if __name__ == "__main__":
-
-    ###############################################
-    #
-    # read input parameters
-    #
-    ###############################################    
-    
-    # read config file name
-    configFile = None
-    try:
-        configFile = sys.argv[1]
-    except:
-        print("[ERROR] -- Config file not provided!")
-        sys.exit(1)
-
-    # read date
-    inputDate = None
-    try:
-        inputDate = sys.argv[2]
-    except:
-        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+# read the configuration, open the datasets and return the function
+# rendering a single frame, along with the list of frames to render
+def prepare_frames(configParser, inputDate, days=None):
 
-               
     ###############################################
     #
     # parse config file
     #
     ###############################################
         
-    configParser = configparser.ConfigParser()
-    configParser.read(configFile)
-
     # paths
-    baseEnsPathTemplate = configParser.get("default", "baseEnsPath")
     baseOutputPath = configParser.get("default", "baseOutputPath")    
-    inputFileTemplate = configParser.get("postcardTemp", "inputFile")
-    inputFiles = []
     outputFolder = configParser.get("postcardTemp", "outputFolder")
     outputFileTemplate = configParser.get("postcardTemp", "outputName")
+    outputResolutions = output_resolutions(configParser, "postcardTemp")
+    inputFiles = member_files(configParser, "postcardTemp", inputDate)
+    members = len(inputFiles)
     print("[%s] -- Input files set to:" % (appname))
-    for i in range(10):
-        inputFile = os.path.join(baseEnsPathTemplate.format(INSTANCE=i, DATE=inputDate), inputFileTemplate.format(DATE=inputDate))
-        inputFiles.append(inputFile)
+    for inputFile in inputFiles:
         print(inputFile)
 
     # create output folder if needed
@@ -92,6 +72,7 @@ if __name__ == "__main__":
     if not os.path.exists(dst):
         os.makedirs(dst, exist_ok=True)
     print("[%s] -- Output folder set to: %s" % (appname, dst))
+    print("[%s] -- Additional resolutions set to: %s" % (appname, outputResolutions))
     
     # black sea mask
     blackSeaMaskLat = configParser.getfloat("default", "blackSeaMaskLat")
@@ -100,19 +81,30 @@ if __name__ == "__main__":
 
     # chart details
     resolution = configParser.get("postcardTemp", "resolution")
+    cachePath = configParser.get("default", "cachePath", fallback=None)
+    backgroundLayer = configParser.get("default", "backgroundLayer", fallback="vector")
+    renderEngine = render_engine(configParser, "postcardTemp")
     colorMap = configParser.get("postcardTemp", "colorMap")
     minValue_surf = configParser.getfloat("postcardTemp", "minValue_surf")
     maxValue_surf = configParser.getfloat("postcardTemp", "maxValue_surf")
     minValue_bott = configParser.getfloat("postcardTemp", "minValue_bott")
     maxValue_bott = configParser.getfloat("postcardTemp", "maxValue_bott")    
     levels = configParser.getint("postcardTemp", "levels")
+    rangePercentiles = parse_percentiles(configParser.get("postcardTemp", "rangePercentiles", fallback=""))
     print("[%s] -- Resolution set to: %s" % (appname, resolution))
+    print("[%s] -- Cache path set to: %s" % (appname, cachePath))
+    print("[%s] -- Background layer mode set to: %s" % (appname, backgroundLayer))
+    print("[%s] -- Render engine set to: %s" % (appname, renderEngine))
     print("[%s] -- Min Value (surf) set to: %s" % (appname, minValue_surf))
     print("[%s] -- Max Value (surf) set to: %s" % (appname, maxValue_surf))
     print("[%s] -- Min Value (bott) set to: %s" % (appname, minValue_bott))
     print("[%s] -- Max Value (bott) set to: %s" % (appname, maxValue_bott))    
     print("[%s] -- Color map set to: %s" % (appname, colorMap))
     print("[%s] -- Levels set to: %s" % (appname, levels))
+    print("[%s] -- Range percentiles set to: %s" % (appname, rangePercentiles))
+    sliceStore = slice_store(configParser, "postcardTemp", inputDate)
+    print("[%s] -- Slice store set to: %s" % (appname, sliceStore))
+    init_timings(configParser)
                     
         
     ###############################################
@@ -121,117 +113,189 @@ if __name__ == "__main__":
     #
     ###############################################
 
-    # open files
-    datasets = []
-    for i in inputFiles:
-        datasets.append(xarray.open_dataset(i))
+    # open the member files as a single (member, time, depth, lat, lon) cube
+    set_frame("postcardTemp", inputDate)
+    with timed("open"):
+        cube = open_ensemble(inputFiles, ["votemper"], sliceStore)
 
     # grid indices
-    x = datasets[0].nav_lon.transpose().values[0]
-    y = datasets[0].nav_lat.values[0]
+    x = cube.nav_lon.transpose().values[0]
+    y = cube.nav_lat.values[0]
 
     # lats and lons
-    lats = datasets[0].nav_lat.transpose().values[0]
-    lons = datasets[0].nav_lon.values[0]
+    lats = cube.nav_lat.transpose().values[0]
+    lons = cube.nav_lon.values[0]
 
     # create the grid
     xxx, yyy = meshgrid(lons, lats)
-    
-    # define a timestep index (to keep track of the timesteps) and an index to keep track of the day we are in
-    timestep_index = 0
-    day_current_index = 0
-    old_day = str(datasets[0].time_counter[0].values).split("T")[0]
 
-    # iterate over timesteps    
-    for t in datasets[0].time_counter:
+    # the black sea mask only depends on the grid, build it once
+    blackSeaMask = black_sea_mask(yyy, xxx, blackSeaMaskLat, blackSeaMaskLon)
+
+    # map the requested days (all by default) straight to their timesteps
+    # and compute the dates of all the timesteps at once
+    timesteps = timesteps_for_days(cube.time_counter.values, days)
+    dates, months, hours = timestep_labels(cube.time_counter.values)
+    uniqueDays, dayIndices = day_groups(cube.time_counter.values)
+
+    # collect the frames (timestep and depth indices)
+    frames = [(int(timestep_index), depth_index) for timestep_index in timesteps for depth_index in range(len(cube.deptht))]
+
+    # render a frame
+    def render_frame(frame):
 
-        # get the date of the current timestep, and optionally update the variable and index keeping track of the day
-        d1 = str(t.values).split("T")[0]
-        if d1 != old_day:
-            old_day = d1
-            day_current_index += 1
+        timestep_index, depth_index = frame
+        d = cube.deptht[depth_index]
 
         # get days string
-        hour = str(t).split("T")[1].split(":")[0]
-        minu = 30
-        d2 = "%s:%s" % (hour, minu)
+        d1 = dates[timestep_index]
         d3 = "%s, 12:30" % (d1)
         d4 = "%s_1230" % (d1)
 
         # debug print
         print("[%s] -- Timestep: %s" % (appname, d3))
+        set_frame("postcardTemp", d1, dayIndices[timestep_index], d)
 
-        # iterate over depth
-        depth_index = 0
-        for d in datasets[0].deptht:
-            
-            # if depth_index < 2:
-            #     minValue = minValue_surf
-            #     maxValue = maxValue_surf
-            # else:
-            #     minValue = minValue_bott
-            #     maxValue = maxValue_bott
-            
-            fig, axes = plt.subplots(nrows=5, ncols=2)
-            
-            ax_index = 0
-
-            minValue = numpy.min(datasets[ax_index].votemper[timestep_index,depth_index,:,:])
-            maxValue = numpy.max(datasets[ax_index].votemper[timestep_index,depth_index,:,:])
-            
-            for ax in axes.flat:
-                # create basemap
-                bmap = Basemap(resolution=resolution,
-                               llcrnrlon=lons[0],llcrnrlat=lats[0],
-                               urcrnrlon=lons[-1],urcrnrlat=lats[-1], ax=ax)                
-
-                # contourf
-                mean_data_0 = datasets[ax_index].votemper[timestep_index,depth_index,:,:]
-                mean_data_1 = mean_data_0.where(((mean_data_0.nav_lat <= blackSeaMaskLat) | (mean_data_0.nav_lon <= blackSeaMaskLon)))
-                mean_data_2 = mean_data_1.where(mean_data_1 > 0, other=np.nan)
-                mean_data = mean_data_2
-                  
-                # get the mean -- mask the black sea -- part 2
-                # mean_data_2 = mean_data_1.where((mean_data_1['lat'] <= blackSeaMaskLat) | (mean_data_1['lon'] <= blackSeaMaskLon), np.nan)                    
-
-                minValue = numpy.nanmin(mean_data_2.values)
-                
-                contour_levels = linspace(minValue, maxValue, levels)
-                im = ax.contourf(xxx, yyy, mean_data, cmap=colorMap, levels=contour_levels, extend='both')
-                
-                ax.set_title("Member %s" % ax_index, fontsize = 5, pad = 4)
-                ax.axis('off')
-                ax_index += 1
-
-                # draw coastlines, country boundaries, fill continents.
-                bmap.drawcoastlines(linewidth=0.25)
-                bmap.fillcontinents(color='white')
-                bmap.drawparallels(range(0, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-                bmap.drawmeridians(range(-90, 90, 5), linewidth=0.1, labels=[1,0,0,1], fontsize=2)
-             
-            # colorbar
+        # if depth_index < 2:
+        #     minValue = minValue_surf
+        #     maxValue = maxValue_surf
+        # else:
+        #     minValue = minValue_bott
+        #     maxValue = maxValue_bott
+
+        # read the slice of all the members at once and mask land and
+        # black sea
+        with timed("read") as t:
+            mean_data_0 = cube.votemper[:,timestep_index,depth_index,:,:].values
+            t["bytes"] = mean_data_0.nbytes
+        with timed("mask"):
+            members_data = apply_mask(mean_data_0, blackSeaMask, positive=True)
+
+        # colour range, contour levels and ticks shared by all the panels,
+        # computed over all the members before drawing
+        with timed("minmax"):
+            minValue, maxValue = frame_range(members_data, rangePercentiles)
+            contour_levels = linspace(minValue, maxValue, levels)
             ticks = range(int(minValue), int(maxValue)+1, 1)
+
+        fig, axes = plt.subplots(nrows=(members + 1) // 2, ncols=2)
+
+        ax_index = 0
+        for ax in axes.flat:
+
+            # odd number of members: leave the last panel empty
+            if ax_index >= members:
+                ax.axis('off')
+                continue
+
+            # create basemap
+            with timed("basemap"):
+                bmap = get_basemap(resolution, lons, lats, ax=ax, cachePath=cachePath)                
+
+            # contourf
+            mean_data = members_data[ax_index]
+
+            # get the mean -- mask the black sea -- part 2
+            # mean_data_2 = mean_data_1.where((mean_data_1['lat'] <= blackSeaMaskLat) | (mean_data_1['lon'] <= blackSeaMaskLon), np.nan)                    
+
+            with timed(renderEngine):
+                if renderEngine == "raster":
+                    im = draw_raster(ax, xxx, yyy, mean_data, colorMap, contour_levels)
+                else:
+                    im = ax.contourf(xxx, yyy, mean_data, cmap=colorMap, levels=contour_levels, extend='both')
+
+            ax.set_title("Member %s" % ax_index, fontsize = 5, pad = 4)
+            ax.axis('off')
+            ax_index += 1
+
+            # draw coastlines, fill continents and graticule
+            with timed("background"):
+                draw_background(bmap, ax, mode=backgroundLayer, coastlineWidth=0.25, landColor="white", cachePath=cachePath)
+
+        # colorbar
+        with timed("colorbar"):
             cb = fig.colorbar(im, ax=axes.ravel().tolist(), ticks=ticks, shrink=0.5)
             cb.set_label("Temperature (degC)", fontsize = 3)
             cb.ax.tick_params(labelsize=3)
             for t in cb.ax.get_xticklabels():
                 t.set_fontsize(1)
-            
-            # title
-            finalDate = d1 # "%s:30" % (d3.split(":")[0])
-            plt.suptitle("Temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
-                
-            # save file
-            di = datasets[0].deptht.values.tolist().index(d)
-            filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))                    
-            plt.savefig(filename, dpi=300, bbox_inches="tight")
-            print("File %s generated" % filename)
-
-            fig.clear()
-            plt.close(fig)
-        
-            # increment depth
-            depth_index += 1
 
-        # increment timestep
-        timestep_index += 1
+        # title
+        finalDate = d1 # "%s:30" % (d3.split(":")[0])
+        plt.suptitle("Temperature at %s m\nDaily mean: %s" % (int(d), finalDate), fontsize = 5)
+
+        # save file
+        di = cube.deptht.values.tolist().index(d)
+        filename = os.path.join(dst, outputFileTemplate.format(DATE=d4, DEPTH=di))                    
+        with timed("savefig") as t:
+            written = save_crops(fig, [(filename, None)], dpi=300, resolutions=outputResolutions)
+            t["bytes"] = sum(os.path.getsize(output) for output in written)
+        for output in written:
+            print("File %s generated" % output)
+
+        fig.clear()
+        plt.close(fig)
+        end_frame(filename)
+
+        return written
+
+    # skip the frames already rendered from the same inputs (resume mode)
+    return track_frames(configParser, "postcardTemp", inputFiles, dst, render_frame, frames, dayIndices)
+
+
+# render all the frames, optionally on a pool of worker processes
+def run(configParser, inputDate, days=None):
+    renderFrame, frames = prepare_frames(configParser, inputDate, days)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    return run_frames(renderFrame, frames, workers, appname)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################    
+    
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render (a day index, a range like 1-11, or "all",
+    # the default)
+    try:
+        days = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (sys.argv[3], e))
+        sys.exit(1)
+    print("[%s] -- Days set to: %s" % (appname, "all" if days is None else days))
+
+        
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+        
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, days)
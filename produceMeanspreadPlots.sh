@@ -29,23 +29,19 @@ bsub () {
 source $HOME/.bash_anaconda_3.7
 conda activate /work/opa/medens-dev/.conda/plot
 
-# iterate over the days and over the variables
-for DAY in $(seq 0 8); do
+# days rendered by each job
+DAYS="1-11"
 
-    # debug print
-    echo "$APP_NAME Day $DAY"
-
-    for VAR in ${VARIABLES[*]}; do
+# iterate over the variables (one job renders all the days)
+for VAR in ${VARIABLES[*]}; do
 
-	# debug print
-	echo "$APP_NAME === Variable $VAR"
-
-	# executable
-	EXE_PATH=$SCRIPT_PATH/mean_spread_${VAR}.py
-	echo -n "Invoking $SCRIPT_PATH/${CTYPE}_${VAR}.py ${CONFIG_FILE} ${DATE} ${DAY}..."	
-	JOBID=$(bsub -q s_medium -P 0510 -J "plot_${CTYPE}_${VAR}_${DAY}" -o ${LOG_PATH}/plot_${CTYPE}_${VAR}_${DATE}_${DAY}__%J.log -e ${LOG_PATH}/plot_${CTYPE}_${VAR}_${DATE}_${DAY}__%J.err "python $EXE_PATH ${CONFIG_FILE} ${DATE} ${DAY}" &)
-	echo $JOBID
-	    	
-    done
-    
+    # debug print
+    echo "$APP_NAME === Variable $VAR"
+
+    # executable
+    EXE_PATH=$SCRIPT_PATH/mean_spread_${VAR}.py
+    echo -n "Invoking $SCRIPT_PATH/${CTYPE}_${VAR}.py ${CONFIG_FILE} ${DATE} ${DAYS}..."	
+    JOBID=$(bsub -q s_medium -P 0510 -J "plot_${CTYPE}_${VAR}" -o ${LOG_PATH}/plot_${CTYPE}_${VAR}_${DATE}__%J.log -e ${LOG_PATH}/plot_${CTYPE}_${VAR}_${DATE}__%J.err "python $EXE_PATH ${CONFIG_FILE} ${DATE} ${DAYS}" &)
+    echo $JOBID
+    	
 done
@@ -53,15 +53,16 @@ conda activate $CONDA_PLOT_ENV_NAME
 echo "[$APPNAME] -- Loading $TELEGRAM_CONFIG_FILE"
 source $TELEGRAM_CONFIG_FILE
 
-# set variables
-VARIABLES=("ssh" "temperature" "currents" "salinity")
-# VARIABLES=("temperature")
-
 # set paths
 SCRIPT_PATH=$PLOTTER_BASE_PATH
 
 # read input params
+# - DATE is the production date
+# - MODE is "batch" (default) to render once all the inputs are there,
+#   "watch" to render each product as soon as its inputs land, or "zygote"
+#   to import the plotting stack once and fork a process per product
 DATE=$3
+MODE=${4:-batch}
 
 # debug info
 $TELEGRAM -t $TELEGRAMBOT -c $TELEGRAMCHAT "$(echo -e '\U00002699') ProducePlot script is starting! [$DATE]"
@@ -79,40 +80,36 @@ bsub () {
     command bsub $* | head -n1 | cut -d'<' -f2 | cut -d'>' -f1
 }   
 
-# iterate over the days for mean spread plots
-for DAY in $(seq 1 11); do
-
-    # debug print
-    echo "$APPNAME Day $DAY"
-
-    # iterate over variables
-    for VAR in ${VARIABLES[*]}; do
-
-	# debug print
-	echo "$APPNAME === Variable $VAR"
-
-	    # executable
-	    EXE_PATH=$SCRIPT_PATH/mean_spread_${VAR}.py
-	    echo -n "Invoking $SCRIPT_PATH/mean_spread_${VAR}.py ${PLOT_CONFIG_FILE} ${DATE} ${DAY}..."
-	    
-	    JOBID=$(bsub -q s_medium -P 0510 -J "plot_mean_spread_${VAR}_${DAY}" -o ${LOG_PATH}/plot_mean_spread_${VAR}_${DATE}_${DAY}__%J.log -e ${LOG_PATH}/plot_mean_spread_${VAR}_${DATE}_${DAY}__%J.err "python $EXE_PATH ${PLOT_CONFIG_FILE} ${DATE} ${DAY}" &)
-	    echo $JOBID
-	    
-    done
-    
-done
-
-# iterate over the variables for postage charts
-for VAR in ${VARIABLES[*]}; do
-    
-    # debug print
-    echo "$APPNAME === Variable $VAR"
-    
-    # executable
-    EXE_PATH=$SCRIPT_PATH/postage_${VAR}.py
-    echo -n "Invoking $SCRIPT_PATH/postage_${VAR}.py ${PLOT_CONFIG_FILE} ${DATE} ${DAY}..."
-	    
-    JOBID=$(bsub -q s_medium -P 0510 -J "plot_postage_${VAR}_${DAY}" -o ${LOG_PATH}/plot_postage_${VAR}_${DATE}_${DAY}__%J.log -e ${LOG_PATH}/plot_postage_${VAR}_${DATE}_${DAY}__%J.err "python $EXE_PATH ${PLOT_CONFIG_FILE} ${DATE} ${DAY}" &)
-    echo $JOBID
-    
-done	   
+# days rendered for the mean spread and the postage products
+DAYS="1-11"
+POSTAGE_DAYS="all"
+
+# a single job renders all the variables and product types (the task
+# list comes from the sections of the plot configuration file)
+if [[ $MODE == "watch" ]]; then
+    EXE_PATH=$SCRIPT_PATH/watch_inputs.py
+elif [[ $MODE == "zygote" ]]; then
+    EXE_PATH=$SCRIPT_PATH/zygote.py
+else
+    EXE_PATH=$SCRIPT_PATH/render_all.py
+fi
+
+# read an option of a section of the plot configuration file
+plot_option () {
+    awk -F '=' -v section="[$1]" -v option="$2" \
+	'/^\[/ {current=$0} current == section && $1 ~ "^"option" *$" {gsub(/ /, "", $2); print $2}' $PLOT_CONFIG_FILE
+}
+
+# the frames are rendered by a pool of [default] workers processes (one
+# pool per forked task in zygote mode): request as many cores, on a
+# single host
+CORES=$(plot_option default workers)
+CORES=${CORES:-1}
+if [[ $MODE == "zygote" ]]; then
+    PROCESSES=$(plot_option zygote processes)
+    CORES=$(( CORES * ${PROCESSES:-4} ))
+fi
+echo -n "Invoking $EXE_PATH ${PLOT_CONFIG_FILE} ${DATE} ${DAYS} ${POSTAGE_DAYS} on ${CORES} core(s)..."
+
+JOBID=$(bsub -q s_medium -P 0510 -n ${CORES} -R "span[hosts=1]" -J "plot_all" -o ${LOG_PATH}/plot_all_${DATE}__%J.log -e ${LOG_PATH}/plot_all_${DATE}__%J.err "python $EXE_PATH ${PLOT_CONFIG_FILE} ${DATE} ${DAYS} ${POSTAGE_DAYS}" &)
+echo $JOBID
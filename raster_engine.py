@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from matplotlib.colors import BoundaryNorm, ListedColormap, Normalize
+from matplotlib.cm import ScalarMappable
+import matplotlib.pyplot as plt
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "RasterEngine"
+
+# engines drawing the filled fields, selected with the renderEngine option
+engines = ("contourf", "raster")
+
+
+###############################################
+#
+# engine selection
+#
+###############################################
+
+# read the renderEngine option of a config section, falling back to the
+# default section and then to contourf
+def render_engine(configParser, section):
+    engine = configParser.get(section, "renderEngine",
+                              fallback=configParser.get("default", "renderEngine", fallback="contourf"))
+    if engine not in engines:
+        raise ValueError("unknown render engine %s" % engine)
+    return engine
+
+
+###############################################
+#
+# raster engine
+#
+###############################################
+
+# lookup table of the colours of a contourf with the given levels: the
+# under colour, one colour per band (that of its mid value, as contourf
+# does), the over colour and a transparent entry for the masked cells.
+# Without extend ("neither"), values out of the levels are transparent too
+def colormap_lut(cmap, levels, vmin=None, vmax=None, extend="both"):
+    cmap = plt.get_cmap(cmap)
+    levels = numpy.asarray(levels, dtype=float)
+    norm = Normalize(levels[0] if vmin is None else vmin, levels[-1] if vmax is None else vmax)
+    lut = numpy.zeros((len(levels) + 2, 4), dtype=numpy.uint8)
+    lut[1:len(levels)] = cmap(norm((levels[:-1] + levels[1:]) / 2), bytes=True)
+    if extend == "both":
+        lut[0] = cmap(norm(-numpy.inf), bytes=True)
+        lut[len(levels)] = cmap(norm(numpy.inf), bytes=True)
+    return lut
+
+
+# draw a field on a regular lat/lon grid (xxx and yyy as returned by
+# meshgrid) as an image, mapping every cell to its colour through the
+# lookup table instead of building contour polygons. Returns a mappable
+# with the same colours and levels, for the colorbar
+def draw_raster(ax, xxx, yyy, data, cmap, levels, vmin=None, vmax=None, extend="both"):
+
+    lut = colormap_lut(cmap, levels, vmin, vmax, extend)
+    levels = numpy.asarray(levels, dtype=float)
+
+    # band index of every cell (0 under, len(levels) over), masked cells
+    # and missing values point to the transparent entry
+    data = numpy.ma.masked_invalid(data)
+    values = data.filled(levels[0])
+    indices = numpy.searchsorted(levels, values, side="right")
+    indices[values == levels[-1]] = len(levels) - 1
+    indices[numpy.ma.getmaskarray(data)] = len(levels) + 1
+    rgba = lut[indices]
+
+    # image covering the grid cells
+    lons = xxx[0, :]
+    lats = yyy[:, 0]
+    dx = (lons[-1] - lons[0]) / (len(lons) - 1) / 2
+    dy = (lats[-1] - lats[0]) / (len(lats) - 1) / 2
+    ax.imshow(rgba, origin="lower", interpolation="nearest", aspect="auto",
+              extent=(lons[0] - dx, lons[-1] + dx, lats[0] - dy, lats[-1] + dy))
+
+    # mappable for the colorbar, with a colour per band (and the under and
+    # over colours when extended)
+    if extend == "both":
+        mappable = ScalarMappable(norm=BoundaryNorm(levels, len(levels) + 1, extend="both"),
+                                  cmap=ListedColormap(lut[:len(levels) + 1] / 255.0))
+    else:
+        mappable = ScalarMappable(norm=BoundaryNorm(levels, len(levels) - 1),
+                                  cmap=ListedColormap(lut[1:len(levels)] / 255.0))
+    mappable.set_array(data)
+    return mappable
@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from ensemble_stats import compute_stats
+from frame_pool import run_frames
+from time_index import parse_days
+import mean_spread_temperature
+import mean_spread_salinity
+import mean_spread_currents
+import mean_spread_ssh
+import postage_temperature
+import postage_salinity
+import postage_currents
+import postage_ssh
+import map_tiles
+import configparser
+import datetime
+import sys
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "RenderAll"
+
+# products that can be rendered: config section -> (script, product type)
+products = {
+    "ssh": (mean_spread_ssh, "meanSpread"),
+    "temperature": (mean_spread_temperature, "meanSpread"),
+    "salinity": (mean_spread_salinity, "meanSpread"),
+    "currents": (mean_spread_currents, "meanSpread"),
+    "postcardSsh": (postage_ssh, "postage"),
+    "postcardTemp": (postage_temperature, "postage"),
+    "postcardSalinity": (postage_salinity, "postage"),
+    "postcardCurrents": (postage_currents, "postage"),
+}
+
+
+###############################################
+#
+# tasks
+#
+###############################################
+
+# the sections to render: those listed in the tasks option of the
+# default section or, by default, all the product sections of the config
+def task_list(configParser):
+    tasks = [t.strip() for t in configParser.get("default", "tasks", fallback="").split(",") if t.strip()]
+    if not tasks:
+        tasks = [section for section in configParser.sections() if section in products]
+    for task in tasks:
+        if task not in products:
+            print("[%s] -- Skipping unknown task %s" % (appname, task))
+    return [task for task in tasks if task in products]
+
+
+# prepare the frames of all the tasks. Every script opens its datasets
+# and builds its renderer in this process, so imports, basemaps and
+# background layers are shared by all of them. Frames are tagged with the
+# index of their task, so that a single pool renders them all. A task that
+# fails to prepare (e.g. missing or broken inputs) is skipped, so that it
+# does not stop the others
+def prepare_tasks(configParser, inputDate, meanSpreadDays=None, postageDays=None):
+
+    renderers = []
+    frames = []
+    for task in task_list(configParser):
+        module, productType = products[task]
+        days = meanSpreadDays if productType == "meanSpread" else postageDays
+        print("[%s] -- Preparing task %s" % (appname, task))
+        try:
+            renderFrame, taskFrames = module.prepare_frames(configParser, inputDate, days)
+        except Exception as e:
+            print("[%s] -- Skipping task %s: %s" % (appname, task, e))
+            continue
+        frames += [(len(renderers), frame) for frame in taskFrames]
+        renderers.append(renderFrame)
+
+    # render a frame of any task
+    def render_frame(frame):
+        task_index, task_frame = frame
+        return renderers[task_index](task_frame)
+
+    return render_frame, frames
+
+
+# render all the frames of all the tasks, optionally on a pool of worker
+# processes, after computing the ensemble statistics if requested, and
+# then the map tiles if enabled
+def run(configParser, inputDate, meanSpreadDays=None, postageDays=None):
+
+    # compute the mean/std files from the members, instead of waiting for
+    # them to be produced upstream
+    if configParser.getboolean("ensembleStats", "enabled", fallback=False):
+        compute_stats(configParser, inputDate)
+
+    renderFrame, frames = prepare_tasks(configParser, inputDate, meanSpreadDays, postageDays)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Rendering %s frames with %s worker(s)" % (appname, len(frames), workers))
+    results = run_frames(renderFrame, frames, workers, appname)
+
+    # tile pyramids of the mean, spread and member fields for the map server
+    if configParser.getboolean("tiles", "enabled", fallback=False):
+        map_tiles.run(configParser, inputDate, meanSpreadDays)
+    return results
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render for the mean_spread and the postage products
+    # (a day index, a range like 1-11, or "all", the default)
+    try:
+        meanSpreadDays = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+        postageDays = parse_days(sys.argv[4] if len(sys.argv) > 4 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (" ".join(sys.argv[3:]), e))
+        sys.exit(1)
+    print("[%s] -- Mean spread days set to: %s" % (appname, "all" if meanSpreadDays is None else meanSpreadDays))
+    print("[%s] -- Postage days set to: %s" % (appname, "all" if postageDays is None else postageDays))
+
+
+    ###############################################
+    #
+    # parse config file and render
+    #
+    ###############################################
+
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    run(configParser, inputDate, meanSpreadDays, postageDays)
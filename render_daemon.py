@@ -0,0 +1,294 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+from dataset_loader import collect_datasets
+from render_all import products
+import socketserver
+import configparser
+import collections
+import json
+import time
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "RenderDaemon"
+
+
+###############################################
+#
+# warm state
+#
+###############################################
+
+# least recently used cache with a limit on the total size of the values,
+# calling onEvict on the values it drops
+class LRUCache:
+
+    def __init__(self, maxSize, sizeOf=lambda value: 1, onEvict=lambda value: None):
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf
+        self.onEvict = onEvict
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.pop(key)
+        self.entries[key] = value
+        self.size += self.sizeOf(value)
+        while self.size > self.maxSize and len(self.entries) > 1:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key):
+        if key in self.entries:
+            value = self.entries.pop(key)
+            self.size -= self.sizeOf(value)
+            self.onEvict(value)
+
+    def clear(self):
+        for key in list(self.entries):
+            self.pop(key)
+
+    def stats(self):
+        return {"entries": len(self.entries), "size": self.size, "maxSize": self.maxSize,
+                "hits": self.hits, "misses": self.misses}
+
+
+# total size of the images of a cache entry
+def images_size(entry):
+    return sum(len(image) for image in entry["images"])
+
+
+# close the datasets of a dropped task
+def close_task(task):
+    for ds in task["datasets"]:
+        ds.close()
+
+
+# renderer of the products, keeping in memory the prepared tasks (opened
+# datasets, grids and masks, by section and date) and the images
+# already rendered. Basemaps, backgrounds, colormaps and fonts are cached
+# by the modules themselves, so they stay warm across requests
+class Renderer:
+
+    def __init__(self, configParser):
+
+        # frames are always rendered on request: the daemon keeps its own
+        # cache of images instead of skipping them through the manifest
+        self.configParser = configParser
+        self.configParser.set("default", "resume", "false")
+        warmTasks = configParser.getint("daemon", "warmTasks", fallback=8)
+        imageCacheMB = configParser.getint("daemon", "imageCacheMB", fallback=256)
+        print("[%s] -- Warm tasks set to: %s" % (appname, warmTasks))
+        print("[%s] -- Image cache set to: %s MB" % (appname, imageCacheMB))
+        self.tasks = LRUCache(warmTasks, onEvict=close_task)
+        self.images = LRUCache(imageCacheMB * 1024 * 1024, images_size)
+
+    # prepare (or reuse) the renderer and the frames of all the days of a
+    # date, along with the datasets it opened
+    def task(self, section, date):
+        key = (section, date)
+        task = self.tasks.get(key)
+        if task is None:
+            module, productType = products[section]
+            print("[%s] -- Preparing %s %s" % (appname, section, date))
+            with collect_datasets() as datasets:
+                renderFrame, frames = module.prepare_frames(self.configParser, date)
+            task = {"renderFrame": renderFrame, "frames": frames, "datasets": datasets}
+            self.tasks.put(key, task)
+        return task
+
+    # render the frames of a day at a depth index (every depth when None,
+    # ignored by the surface products), unless already cached and still on
+    # disk. Returns the cache entry (output paths and image bytes), None
+    # when there is no such frame
+    def render(self, section, date, day, depth=None):
+
+        key = (section, date, day, depth)
+        entry = self.images.get(key)
+        if entry is not None and entry["mtimes"] == [os.stat(output).st_mtime_ns if os.path.exists(output) else None for output in entry["outputs"]]:
+            return dict(entry, cached=True)
+        self.images.pop(key)
+
+        task = self.task(section, date)
+        renderFrame = task["renderFrame"]
+        frames = [frame for frame in task["frames"] if renderFrame.frame_day(frame) == day and
+                  (depth is None or not isinstance(frame, tuple) or frame[1] == depth)]
+        if not frames:
+            return None
+
+        outputs = []
+        for frame in frames:
+            outputs += renderFrame(frame)
+        images = []
+        for output in outputs:
+            with open(output, "rb") as f:
+                images.append(f.read())
+        entry = {"outputs": outputs, "images": images,
+                 "mtimes": [os.stat(output).st_mtime_ns for output in outputs]}
+        self.images.put(key, entry)
+        return dict(entry, cached=False)
+
+    # drop the warm state and the cached images (e.g. after new inputs
+    # have been published for a date already served)
+    def flush(self):
+        self.tasks.clear()
+        self.images.clear()
+
+    def stats(self):
+        return {"tasks": self.tasks.stats(), "images": self.images.stats()}
+
+
+###############################################
+#
+# request API
+#
+###############################################
+
+# handler of the requests:
+#   GET /render?section=postcardTemp&date=20240101&day=0&depth=0[&format=png&index=0]
+#       renders (or takes from the cache) the images of a frame and returns
+#       the output paths as JSON or, with format=png, the bytes of an image
+#   GET /status    statistics of the caches
+#   GET /flush     drop the warm state and the cached images
+# Requests are served one at a time, since matplotlib is not thread safe
+class RequestHandler(BaseHTTPRequestHandler):
+
+    renderer = None
+
+    def send(self, code, body, contentType="application/json"):
+        if contentType == "application/json":
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        if url.path == "/status":
+            self.send(200, self.renderer.stats())
+            return
+        elif url.path == "/flush":
+            self.renderer.flush()
+            self.send(200, self.renderer.stats())
+            return
+        elif url.path != "/render":
+            self.send(404, {"error": "unknown path %s" % url.path})
+            return
+
+        # read the request
+        try:
+            section = query["section"]
+            date = query["date"]
+            day = int(query.get("day", 0))
+            depth = int(query["depth"]) if query.get("depth", "") != "" else None
+            index = int(query.get("index", 0))
+        except (KeyError, ValueError) as e:
+            self.send(400, {"error": "invalid request: %s" % e})
+            return
+        if section not in products:
+            self.send(400, {"error": "unknown section %s" % section})
+            return
+
+        # render
+        try:
+            startTime = time.time()
+            entry = self.renderer.render(section, date, day, depth)
+            if entry is None:
+                self.send(404, {"error": "no frames for %s %s day %s depth %s" % (section, date, day, depth)})
+            elif query.get("format") == "png":
+                if not 0 <= index < len(entry["images"]):
+                    self.send(404, {"error": "no image %s" % index})
+                else:
+                    self.send(200, entry["images"][index], "image/png")
+            else:
+                self.send(200, {"outputs": entry["outputs"], "cached": entry["cached"],
+                                "seconds": round(time.time() - startTime, 3)})
+        except Exception as e:
+            print("[%s] -- Request %s failed: %s" % (appname, self.path, e))
+            self.send(500, {"error": str(e)})
+
+    # unix sockets have no client address
+    def log_message(self, format, *args):
+        print("[%s] -- %s" % (appname, format % args))
+
+
+# http server listening on a unix socket
+class UnixHTTPServer(socketserver.UnixStreamServer):
+    pass
+
+
+# serve the requests on the unix socket set in the daemon section or,
+# when missing, on localhost
+def serve(configParser):
+
+    RequestHandler.renderer = Renderer(configParser)
+    socketPath = configParser.get("daemon", "socket", fallback="")
+    if socketPath:
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        server = UnixHTTPServer(socketPath, RequestHandler)
+        print("[%s] -- Listening on %s" % (appname, socketPath))
+    else:
+        host = configParser.get("daemon", "host", fallback="127.0.0.1")
+        port = configParser.getint("daemon", "port", fallback=8765)
+        server = HTTPServer((host, port), RequestHandler)
+        print("[%s] -- Listening on http://%s:%s" % (appname, host, port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketPath and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # start the daemon
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    serve(configParser)
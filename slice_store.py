@@ -0,0 +1,199 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from xarray.backends import BackendArray
+from xarray.core import indexing
+from manifest import input_signature
+import itertools
+import hashlib
+import xarray
+import socket
+import numpy
+import json
+import time
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "SliceStore"
+
+# seconds after which the lock of a store creation is considered stale
+lockTimeout = 3600
+
+
+###############################################
+#
+# store location
+#
+###############################################
+
+# read the sliceStore option of a config section, falling back to the
+# default section. Returns the folder of the store (under the output
+# folder of the date) or None if disabled
+def slice_store(configParser, section, inputDate):
+    enabled = configParser.getboolean(section, "sliceStore",
+                                      fallback=configParser.getboolean("default", "sliceStore", fallback=False))
+    if not enabled:
+        return None
+    return os.path.join(configParser.get("default", "baseOutputPath"), inputDate, "slices")
+
+
+# name of the store of a variable of some input files: the variable and a
+# hash of the paths, so that the mean, std and member files never collide
+def store_name(folder, paths, variable):
+    sha1 = hashlib.sha1("\n".join(os.path.abspath(path) for path in paths).encode())
+    return os.path.join(folder, "%s_%s.npy" % (variable, sha1.hexdigest()[:16]))
+
+
+###############################################
+#
+# locking
+#
+###############################################
+
+# take the lock of a store: a file holding the token of its owner (host,
+# process and time). Returns the token, or None if another job holds it.
+# A lock older than lockTimeout is removed, if still held by the same owner
+def acquire_lock(lockFilename):
+    token = "%s %s %s" % (socket.gethostname(), os.getpid(), time.time())
+    try:
+        fd = os.open(lockFilename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(lockFilename) > lockTimeout:
+                owner = read_lock(lockFilename)
+                print("[%s] -- Removing stale lock %s (%s)" % (appname, lockFilename, owner))
+                release_lock(lockFilename, owner)
+        except OSError:
+            pass
+        return None
+    with os.fdopen(fd, "w") as f:
+        f.write(token)
+    return token
+
+
+# token of the owner of a lock, None if missing
+def read_lock(lockFilename):
+    try:
+        with open(lockFilename) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+# release a lock, only if still owned by token
+def release_lock(lockFilename, token):
+    if read_lock(lockFilename) != token:
+        return
+    try:
+        os.remove(lockFilename)
+    except FileNotFoundError:
+        pass
+
+
+###############################################
+#
+# store
+#
+###############################################
+
+# signature of a store, None if missing or unreadable
+def read_signature(filename):
+    try:
+        with open(filename + ".json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# create an empty store: a float32 .npy file of the shape of the variable
+# (sparse until its slices are extracted) and a .npy of flags, one per
+# horizontal slice, set once the slice is extracted. Files are written
+# through temporary files and the signature last, so that concurrent jobs
+# never map a partial store
+def create_store(filename, shape, signature):
+    for name, dtype, storeShape in ((filename, numpy.float32, shape), (filename + ".filled.npy", numpy.uint8, shape[:-2])):
+        tmpFilename = "%s.%s.tmp.npy" % (name, os.getpid())
+        numpy.lib.format.open_memmap(tmpFilename, mode="w+", dtype=dtype, shape=tuple(storeShape)).flush()
+        os.replace(tmpFilename, name)
+    tmpFilename = "%s.%s.tmp.json" % (filename, os.getpid())
+    with open(tmpFilename, "w") as f:
+        json.dump(signature, f)
+    os.replace(tmpFilename, filename + ".json")
+
+
+# map the store of a variable read from some input files, creating it if
+# missing or out of date. Only one job creates a given store: the others
+# wait for its lock to be released. Returns the data and the flags
+def map_store(ds, variable, paths, folder):
+
+    filename = store_name(folder, paths, variable)
+    signature = {"inputs": input_signature(paths), "dims": list(ds[variable].dims), "shape": list(ds[variable].shape)}
+    lockFilename = filename + ".lock"
+    os.makedirs(folder, exist_ok=True)
+
+    while read_signature(filename) != signature:
+        token = acquire_lock(lockFilename)
+        if token is None:
+            time.sleep(1)
+            continue
+        try:
+            if read_signature(filename) != signature:
+                print("[%s] -- Creating the store of %s in %s" % (appname, variable, filename))
+                create_store(filename, ds[variable].shape, signature)
+        finally:
+            release_lock(lockFilename, token)
+
+    return numpy.load(filename, mmap_mode="r+"), numpy.load(filename + ".filled.npy", mmap_mode="r+")
+
+
+# array of a variable backed by its store: the horizontal slices selected
+# are extracted from the input files the first time any job reads them,
+# then read straight from the page cache, shared by all the processes of
+# the node. Slices are stored as decoded, with missing values (land) as
+# NaN: the Black Sea and positivity masks stay in masks.apply_mask, as the
+# currents vectors are drawn from unmasked components
+class StoreArray(BackendArray):
+
+    def __init__(self, source, data, filled):
+        self.source = source
+        self.data = data
+        self.filled = filled
+        self.shape = data.shape
+        self.dtype = data.dtype
+
+    def __getitem__(self, key):
+        return indexing.explicit_indexing_adapter(key, self.shape, indexing.IndexingSupport.BASIC, self.read)
+
+    # read a basic (integers and slices) selection
+    def read(self, key):
+        leading = [range(*k.indices(n)) if isinstance(k, slice) else [k]
+                   for k, n in zip(key[:len(self.shape) - 2], self.shape)]
+        for index in itertools.product(*leading):
+            if not self.filled[index]:
+                self.data[index] = self.source[index].values
+                self.data.flush()
+                self.filled[index] = 1
+                self.filled.flush()
+        return numpy.array(self.data[key])
+
+
+# replace the variables of a dataset with their stores, so that every job
+# reads each slice from the input files only once
+def attach_store(ds, variables, paths, folder):
+    for variable in variables:
+        data, filled = map_store(ds, variable, paths, folder)
+        source = ds[variable].variable
+        array = indexing.LazilyIndexedArray(StoreArray(source, data, filled))
+        ds[variable] = xarray.Variable(source.dims, array, source.attrs)
+    return ds
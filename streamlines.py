@@ -0,0 +1,133 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from matplotlib.collections import LineCollection
+from matplotlib.patches import FancyArrowPatch
+from matplotlib.figure import Figure
+import collections
+import hashlib
+import numpy
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Streamlines"
+
+# streamline geometries computed or loaded by this process, by key
+geometries = collections.OrderedDict()
+
+# number of geometries kept in memory
+maxGeometries = 64
+
+
+###############################################
+#
+# geometry
+#
+###############################################
+
+# key of the streamlines of a field: hash of the grid, of the components
+# (missing and masked values included) and of the density
+def geometry_key(x, y, u, v, density):
+    sha1 = hashlib.sha1()
+    for array in (x, y, u, v):
+        sha1.update(numpy.ma.filled(numpy.ma.asarray(array, dtype=numpy.float64), numpy.nan).tobytes())
+    sha1.update(str(density).encode())
+    return sha1.hexdigest()
+
+
+# integrate the streamlines of a field with matplotlib's streamplot, on an
+# offscreen axis, and keep their geometry: the line segments and, for each
+# trajectory, the tail and head of its arrow (placed halfway along it, as
+# streamplot does)
+def compute_geometry(x, y, u, v, density):
+
+    ax = Figure().add_subplot()
+    stream = ax.streamplot(x, y, u, v, density=density)
+    segments = numpy.asarray(stream.lines.get_segments(), dtype=numpy.float64).reshape(-1, 2, 2)
+
+    # split the segments into trajectories where they stop being contiguous
+    breaks = numpy.flatnonzero((segments[1:, 0] != segments[:-1, 1]).any(axis=1)) + 1
+    arrows = []
+    for trajectory in numpy.split(segments, breaks):
+        if len(trajectory) == 0:
+            continue
+        points = numpy.vstack([trajectory[:, 0], trajectory[-1:, 1]])
+        s = numpy.cumsum(numpy.hypot(*numpy.diff(points, axis=0).T))
+        n = numpy.searchsorted(s, s[-1] / 2.)
+        arrows.append([points[n], points[n:n + 2].mean(axis=0)])
+    return {"segments": segments, "arrows": numpy.asarray(arrows, dtype=numpy.float64).reshape(-1, 2, 2)}
+
+
+# load a geometry from the disk cache, None if missing or unreadable
+def load_geometry(filename):
+    if not os.path.exists(filename):
+        return None
+    try:
+        with numpy.load(filename) as f:
+            return {"segments": f["segments"], "arrows": f["arrows"]}
+    except Exception as e:
+        print("[%s] -- Unable to load %s: %s" % (appname, filename, e))
+        return None
+
+
+# save a geometry to the disk cache, through a temporary file so that
+# concurrent jobs never read a partial one
+def save_geometry(geometry, filename):
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpFilename = "%s.%s.tmp.npz" % (filename, os.getpid())
+        numpy.savez(tmpFilename, segments=geometry["segments"], arrows=geometry["arrows"])
+        os.replace(tmpFilename, filename)
+    except Exception as e:
+        print("[%s] -- Unable to save %s: %s" % (appname, filename, e))
+
+
+# get the streamline geometry of a field, integrating it only once per
+# process and, if cachePath is provided, only once per field across jobs
+def get_streamlines(x, y, u, v, density, cachePath=None):
+
+    key = geometry_key(x, y, u, v, density)
+    if key in geometries:
+        geometries.move_to_end(key)
+        return geometries[key]
+
+    filename = os.path.join(cachePath, "streamlines", "%s.npz" % key) if cachePath else None
+    geometry = load_geometry(filename) if filename else None
+    if geometry is None:
+        geometry = compute_geometry(x, y, u, v, density)
+        if filename:
+            save_geometry(geometry, filename)
+
+    geometries[key] = geometry
+    while len(geometries) > maxGeometries:
+        geometries.popitem(last=False)
+    return geometry
+
+
+###############################################
+#
+# drawing
+#
+###############################################
+
+# draw a streamline geometry on the axis of a basemap, with the same
+# styling options as streamplot. Returns the collection of the lines
+def draw_streamlines(bmap, ax, geometry, linewidth=1, arrowsize=1, color="k"):
+    lines = LineCollection(geometry["segments"], linewidths=linewidth, colors=color)
+    ax.add_collection(lines)
+    for tail, head in geometry["arrows"]:
+        ax.add_patch(FancyArrowPatch(tuple(tail), tuple(head), arrowstyle="-|>", mutation_scale=10 * arrowsize,
+                                     linewidth=linewidth, color=color))
+    bmap.set_axes_limits(ax=ax)
+    return lines
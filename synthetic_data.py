@@ -0,0 +1,224 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from dataset_loader import member_files
+import configparser
+import datetime
+import xarray
+import numpy
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "SyntheticData"
+
+# extent and resolution of the EAS1 Mediterranean grid (1/24 degree)
+lonRange = (-18.125, 36.25)
+latRange = (30.1875, 45.979)
+gridStep = 1.0 / 24
+
+# config sections of the mean/std files and their variables
+meanSpreadFiles = {
+    "temperature": (("meanFile", "votemper"), ("stdFile", "votemper")),
+    "salinity": (("meanFile", "vosaline"), ("stdFile", "vosaline")),
+    "ssh": (("meanFile", "sossheig"), ("stdFile", "sossheig")),
+    "currents": (("meanUFile", "vozocrtx"), ("meanVFile", "vomecrty"),
+                 ("stdUFile", "vozocrtx"), ("stdVFile", "vomecrty")),
+}
+
+# variables of the member files, with their vertical axis
+memberVariables = (("votemper", "deptht"), ("vosaline", "deptht"), ("sossheig", None),
+                   ("vozocrtx", "depthu"), ("vomecrty", "depthu"))
+
+
+###############################################
+#
+# grid
+#
+###############################################
+
+# longitudes and latitudes of the grid, Med-sea sized by default
+def grid(step=gridStep):
+    lons = numpy.arange(lonRange[0], lonRange[1] + step / 2, step)
+    lats = numpy.arange(latRange[0], latRange[1] + step / 2, step)
+    return lons, lats
+
+
+# depth levels, stretched towards the bottom like the NEMO ones
+def depth_levels(depths):
+    return numpy.cumsum(2.0 * 1.06 ** numpy.arange(depths)) - 1.0
+
+
+# synthetic land: a wavy coastline pattern that widens with depth
+def land_mask(xxx, yyy, depth):
+    pattern = numpy.sin(xxx / 3.0) * numpy.cos(yyy / 2.0) + 0.5 * numpy.sin((xxx + yyy) / 1.3)
+    return pattern > 0.9 - 0.25 * numpy.log10(1.0 + depth)
+
+
+###############################################
+#
+# fields
+#
+###############################################
+
+# smooth 2D field of a variable at a given depth and day. Members are
+# obtained perturbing the field with a member dependent pattern; member
+# None gives the ensemble mean and spread=True the ensemble spread
+def field(variable, xxx, yyy, depth, day, member=None, spread=False):
+
+    eddies = numpy.sin(xxx / 1.7 + 0.3 * day) * numpy.cos(yyy / 1.1 - 0.2 * day)
+    decay = numpy.exp(-depth / 150.0)
+    if spread:
+        return (0.05 + 0.2 * decay * numpy.abs(eddies)).astype(numpy.float32)
+
+    perturbation = 0.0
+    if member is not None:
+        perturbation = 0.1 * numpy.sin(xxx / 2.3 + member) * numpy.cos(yyy / 1.9 - member)
+
+    if variable == "votemper":
+        surface = 26.0 - 8.0 * (yyy - latRange[0]) / (latRange[1] - latRange[0])
+        data = 13.5 + (surface - 13.5) * decay + 0.8 * eddies * decay + perturbation
+    elif variable == "vosaline":
+        data = 37.0 + 2.0 * (xxx - lonRange[0]) / (lonRange[1] - lonRange[0]) + 0.2 * eddies * decay + 0.1 * perturbation
+    elif variable == "sossheig":
+        data = -0.3 + 0.15 * eddies + 0.1 * perturbation
+    elif variable == "vozocrtx":
+        data = 0.4 * decay * numpy.sin(xxx / 1.7 + 0.3 * day) * numpy.sin(yyy / 1.1 - 0.2 * day) + 0.1 * perturbation
+    else:
+        data = 0.4 * decay * numpy.cos(xxx / 1.7 + 0.3 * day) * numpy.cos(yyy / 1.1 - 0.2 * day) + 0.1 * perturbation
+    return data.astype(numpy.float32)
+
+
+# stack the fields of all the days and depths of a variable, filling land
+# points with landValue (NaN in the mean/std files, 0 in the NEMO ones)
+def variable_cube(variable, xxx, yyy, depths, days, landValue, member=None, spread=False):
+    if depths is None:
+        depths = numpy.zeros(1)
+    cube = numpy.empty((days, len(depths)) + xxx.shape, dtype=numpy.float32)
+    for depth_index, depth in enumerate(depths):
+        land = land_mask(xxx, yyy, depth)
+        for day in range(days):
+            cube[day, depth_index] = field(variable, xxx, yyy, depth, day, member, spread)
+            cube[day, depth_index][land] = landValue
+    return cube
+
+
+###############################################
+#
+# files
+#
+###############################################
+
+# daily timestamps (at 12:00) of the days following inputDate
+def daily_times(inputDate, days):
+    start = numpy.datetime64(datetime.datetime.strptime(inputDate, "%Y%m%d")) + numpy.timedelta64(12, "h")
+    return start + numpy.arange(days) * numpy.timedelta64(1, "D")
+
+
+# write a dataset through a temporary file, so that an interrupted
+# generation never leaves truncated files behind
+def write_dataset(ds, filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmpFilename = "%s.%s.tmp" % (filename, os.getpid())
+    ds.to_netcdf(tmpFilename)
+    os.replace(tmpFilename, filename)
+    print("[%s] -- File %s generated" % (appname, filename))
+
+
+# write the daily mean and std files of all the mean_spread sections,
+# with (time, depth, lat, lon) variables and 1D lat/lon coordinates
+def write_mean_spread(configParser, inputDate, days, depths, step=gridStep):
+
+    lons, lats = grid(step)
+    xxx, yyy = numpy.meshgrid(lons, lats)
+    levels = depth_levels(depths)
+    times = daily_times(inputDate, days)
+    basePath = configParser.get("default", "basePath")
+
+    for section, files in meanSpreadFiles.items():
+        for option, variable in files:
+            filename = os.path.join(basePath, inputDate, configParser.get(section, option))
+            spread = option.startswith("std")
+            if variable == "sossheig":
+                data = variable_cube(variable, xxx, yyy, None, days, numpy.nan, spread=spread)[:, 0]
+                ds = xarray.Dataset({variable: (("time", "lat", "lon"), data)},
+                                    coords={"time": times, "lat": lats, "lon": lons})
+            else:
+                data = variable_cube(variable, xxx, yyy, levels, days, numpy.nan, spread=spread)
+                ds = xarray.Dataset({variable: (("time", "depth", "lat", "lon"), data)},
+                                    coords={"time": times, "depth": levels, "lat": lats, "lon": lons})
+            write_dataset(ds, filename)
+
+
+# write the NEMO-like daily file of each member, with all the variables
+# on (time_counter, deptht/depthu, y, x) and 2D nav_lat/nav_lon
+def write_members(configParser, inputDate, days, depths, step=gridStep):
+
+    lons, lats = grid(step)
+    xxx, yyy = numpy.meshgrid(lons, lats)
+    levels = depth_levels(depths)
+    times = daily_times(inputDate, days)
+
+    for member, filename in enumerate(member_files(configParser, "postcardTemp", inputDate)):
+        variables = {}
+        for variable, depthDim in memberVariables:
+            if depthDim is None:
+                data = variable_cube(variable, xxx, yyy, None, days, 0.0, member)[:, 0]
+                variables[variable] = (("time_counter", "y", "x"), data)
+            else:
+                data = variable_cube(variable, xxx, yyy, levels, days, 0.0, member)
+                variables[variable] = (("time_counter", depthDim, "y", "x"), data)
+        ds = xarray.Dataset(variables, coords={"time_counter": times, "deptht": levels, "depthu": levels,
+                                               "nav_lat": (("y", "x"), yyy.astype(numpy.float32)),
+                                               "nav_lon": (("y", "x"), xxx.astype(numpy.float32))})
+        write_dataset(ds, filename)
+
+
+# generate all the input files of a date
+def generate(configParser, inputDate, days=2, depths=10, step=gridStep):
+    print("[%s] -- Generating %s days, %s depths on a %s x %s grid" %
+          (appname, days, depths, len(grid(step)[1]), len(grid(step)[0])))
+    write_mean_spread(configParser, inputDate, days, depths, step)
+    write_members(configParser, inputDate, days, depths, step)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    # read config file name (its paths tell where to write the files)
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # generate the files
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    days = configParser.getint("benchmark", "days", fallback=2)
+    depths = configParser.getint("benchmark", "depths", fallback=10)
+    generate(configParser, inputDate, days, depths)
@@ -0,0 +1,91 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "TimeIndex"
+
+
+###############################################
+#
+# day selection
+#
+###############################################
+
+# parse the days requested on the command line. Accepted values are a
+# single day index ("3"), an inclusive range ("1-11"), a comma separated
+# list of them ("0,2,5-7") or "all". Returns a sorted list of day indices,
+# or None to select all the days. Raises ValueError on malformed, negative,
+# reversed or empty selections
+def parse_days(value):
+
+    if value is None or value.strip().lower() == "all":
+        return None
+
+    days = set()
+    for item in value.split(","):
+        item = item.strip()
+        if "-" in item:
+            first, last = item.split("-")
+            first, last = int(first), int(last)
+            if last < first:
+                raise ValueError("reversed day range %s" % item)
+            days.update(range(first, last + 1))
+        else:
+            days.add(int(item))
+    if not days:
+        raise ValueError("empty day selection %r" % value)
+    if min(days) < 0:
+        raise ValueError("negative day %s" % min(days))
+    return sorted(days)
+
+
+###############################################
+#
+# day groups
+#
+###############################################
+
+# group the timesteps by day in a single vectorized pass. Returns the
+# distinct days (as datetime64[D]) and, for each timestep, the index of
+# the day it belongs to
+def day_groups(times):
+    days = numpy.asarray(times).astype("datetime64[D]")
+    uniqueDays, dayIndices = numpy.unique(days, return_inverse=True)
+    return uniqueDays, dayIndices
+
+
+# map the requested day indices (None for all the days) straight to the
+# indices of their timesteps. Days beyond the forecast are skipped with a
+# warning, so that a short file only loses its missing days
+def timesteps_for_days(times, days=None):
+    uniqueDays, dayIndices = day_groups(times)
+    if days is None:
+        return numpy.arange(len(dayIndices))
+    outside = [day for day in days if day >= len(uniqueDays)]
+    if outside:
+        print("[%s] -- Skipping days %s outside the forecast (days 0-%s)" % (appname, outside, len(uniqueDays) - 1))
+    return numpy.flatnonzero(numpy.isin(dayIndices, days))
+
+
+# compute the labels of all the timesteps at once: the date (YYYY-MM-DD),
+# the month (1-12) and the zero padded hour
+def timestep_labels(times):
+    times = numpy.asarray(times).astype("datetime64[h]")
+    days = times.astype("datetime64[D]")
+    dates = numpy.datetime_as_string(days, unit="D")
+    months = days.astype("datetime64[M]").astype(int) % 12 + 1
+    hours = numpy.char.zfill((times - days).astype(int).astype(str), 2)
+    return dates, months, hours
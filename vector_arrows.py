@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+import numpy
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "VectorArrows"
+
+# ways of drawing the currents direction, selected with the vectorMode option
+vectorModes = ("streamplot", "quiver")
+
+
+###############################################
+#
+# mode selection
+#
+###############################################
+
+# read the vectorMode and quiverSpacing (pixels between two arrows in the
+# saved image) options of a config section, falling back to the default
+# section
+def vector_mode(configParser, section):
+    mode = configParser.get(section, "vectorMode",
+                            fallback=configParser.get("default", "vectorMode", fallback="streamplot"))
+    if mode not in vectorModes:
+        raise ValueError("unknown vector mode %s" % mode)
+    spacing = configParser.getfloat(section, "quiverSpacing",
+                                    fallback=configParser.getfloat("default", "quiverSpacing", fallback=15))
+    return mode, spacing
+
+
+###############################################
+#
+# quiver
+#
+###############################################
+
+# subsampling stride of a grid drawn on an axis, so that two arrows are
+# at least spacing pixels apart once the figure is saved at dpi
+def quiver_stride(ax, shape, dpi, spacing):
+    fig = ax.figure
+    pos = ax.get_position()
+    cellWidth = pos.width * fig.get_figwidth() * dpi / shape[1]
+    cellHeight = pos.height * fig.get_figheight() * dpi / shape[0]
+    return max(int(numpy.ceil(spacing / min(cellWidth, cellHeight))), 1)
+
+
+# draw the direction of a vector field (xxx and yyy as returned by
+# meshgrid) as arrows of constant length, on a grid subsampled to the size
+# of the panel. unitU and unitV are the unit vectors of the field (see
+# derived_fields); masked and missing ones (zero vectors) are skipped.
+# Returns the quiver
+def draw_quiver(ax, xxx, yyy, unitU, unitV, dpi=300, spacing=15, color="k"):
+
+    stride = quiver_stride(ax, numpy.shape(unitU), dpi, spacing)
+    unitU = numpy.ma.masked_invalid(unitU[::stride, ::stride])
+    unitV = numpy.ma.masked_invalid(unitV[::stride, ::stride])
+
+    # arrows 0.7 spacing long, whatever the speed
+    return ax.quiver(xxx[::stride, ::stride], yyy[::stride, ::stride], unitU, unitV,
+                     color=color, pivot="middle", units="dots", scale_units="dots",
+                     scale=1.0 / (0.7 * spacing), width=max(spacing / 15.0, 1))
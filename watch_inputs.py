@@ -0,0 +1,184 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from ensemble_stats import compute_stats, statsFiles
+from dataset_loader import member_files
+from frame_pool import run_frames
+from time_index import parse_days
+from render_all import products, task_list
+import map_tiles
+import configparser
+import datetime
+import time
+import sys
+import os
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "WatchInputs"
+
+# the member files of all the postcard sections are the same, those of
+# this section are used when the mean/std files are computed here
+membersSection = "postcardTemp"
+
+
+###############################################
+#
+# inputs
+#
+###############################################
+
+# input files of a task: the mean/std files for the mean_spread products
+# (or the member files, when the statistics are computed here) and the
+# member files for the postage products
+def task_inputs(configParser, task, inputDate):
+    module, productType = products[task]
+    if productType == "postage":
+        return member_files(configParser, task, inputDate)
+    if configParser.getboolean("ensembleStats", "enabled", fallback=False):
+        return member_files(configParser, membersSection, inputDate)
+    basePath = configParser.get("default", "basePath")
+    inputFiles = []
+    for section, variable, meanOption, stdOption in statsFiles:
+        if section == task:
+            inputFiles += [os.path.join(basePath, inputDate, configParser.get(section, option)) for option in (meanOption, stdOption)]
+    return inputFiles
+
+
+# size and modification time of the input files, None when missing
+def input_state(inputFiles):
+    state = []
+    for inputFile in inputFiles:
+        try:
+            st = os.stat(inputFile)
+            state.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            return None
+    return state
+
+
+###############################################
+#
+# watch
+#
+###############################################
+
+# poll the input folders and render each task as soon as all its input
+# files are there and have not changed for stableChecks polls (so that
+# files still being written are not read). Returns the tasks not rendered
+# before the timeout
+def watch(configParser, inputDate, meanSpreadDays=None, postageDays=None):
+
+    interval = configParser.getfloat("watch", "interval", fallback=30)
+    timeout = configParser.getfloat("watch", "timeout", fallback=6 * 3600)
+    stableChecks = configParser.getint("watch", "stableChecks", fallback=2)
+    workers = configParser.getint("default", "workers", fallback=1)
+    print("[%s] -- Poll interval set to: %s s" % (appname, interval))
+    print("[%s] -- Timeout set to: %s s" % (appname, timeout))
+    print("[%s] -- Stable checks set to: %s" % (appname, stableChecks))
+
+    pending = {task: task_inputs(configParser, task, inputDate) for task in task_list(configParser)}
+    states = {task: (None, 0) for task in pending}
+    statsDone = not configParser.getboolean("ensembleStats", "enabled", fallback=False)
+    startTime = time.time()
+
+    while pending:
+
+        # tasks whose inputs are complete and stable
+        ready = []
+        for task, inputFiles in pending.items():
+            state = input_state(inputFiles)
+            lastState, count = states[task]
+            count = count + 1 if state is not None and state == lastState else 0
+            states[task] = (state, count)
+            if state is not None and count >= stableChecks - 1:
+                ready.append(task)
+
+        # render them, mean_spread and postage alike
+        for task in ready:
+            module, productType = products[task]
+            if productType == "meanSpread" and not statsDone:
+                compute_stats(configParser, inputDate)
+                statsDone = True
+            days = meanSpreadDays if productType == "meanSpread" else postageDays
+            print("[%s] -- Inputs of %s ready after %.0f s" % (appname, task, time.time() - startTime))
+            del pending[task]
+            try:
+                renderFrame, frames = module.prepare_frames(configParser, inputDate, days)
+            except Exception as e:
+                print("[%s] -- Skipping task %s: %s" % (appname, task, e))
+                continue
+            run_frames(renderFrame, frames, workers, appname)
+
+        if not pending:
+            break
+        if time.time() - startTime > timeout:
+            print("[%s] -- Timeout: inputs of %s still missing" % (appname, ", ".join(pending)))
+            break
+        time.sleep(interval)
+
+    # tile pyramids, once all the inputs have been rendered
+    if not pending and configParser.getboolean("tiles", "enabled", fallback=False):
+        map_tiles.run(configParser, inputDate, meanSpreadDays)
+    return list(pending)
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    ###############################################
+    #
+    # read input parameters
+    #
+    ###############################################
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render for the mean_spread and the postage products
+    # (a day index, a range like 1-11, or "all", the default)
+    try:
+        meanSpreadDays = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+        postageDays = parse_days(sys.argv[4] if len(sys.argv) > 4 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (" ".join(sys.argv[3:]), e))
+        sys.exit(1)
+
+
+    ###############################################
+    #
+    # parse config file and watch
+    #
+    ###############################################
+
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    missing = watch(configParser, inputDate, meanSpreadDays, postageDays)
+    sys.exit(1 if missing else 0)
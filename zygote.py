@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+
+###############################################
+#
+# global reqs
+#
+###############################################
+
+from instrumentation import init_timings, set_frame, emit
+import multiprocessing.connection
+import multiprocessing
+import configparser
+import subprocess
+import importlib
+import datetime
+import time
+import sys
+
+
+###############################################
+#
+# initial config
+#
+###############################################
+
+appname = "Zygote"
+
+# plotting stack imported once by the zygote and inherited by the tasks
+stackModules = ("numpy", "xarray", "netCDF4", "matplotlib", "matplotlib.pyplot", "mpl_toolkits.basemap")
+
+
+###############################################
+#
+# warm up
+#
+###############################################
+
+# time needed by a fresh interpreter just to start, which every separate
+# job pays before its first import
+def interpreter_startup():
+    startTime = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], check=False)
+    return time.perf_counter() - startTime
+
+
+# import the plotting stack and the product scripts and load the fonts
+# used by the figures, so that the forked tasks find them ready. Returns
+# the time spent on each step
+def warm_up():
+
+    timings = {"interpreter": interpreter_startup()}
+
+    startTime = time.perf_counter()
+    for name in stackModules:
+        importlib.import_module(name)
+    importlib.import_module("render_all")
+    timings["imports"] = time.perf_counter() - startTime
+
+    # drawing some text builds (or loads) the font cache and the glyphs
+    startTime = time.perf_counter()
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    fig.text(0.5, 0.5, "warm up 0123456789 (degC)", fontsize=5)
+    fig.canvas.draw()
+    plt.close(fig)
+    timings["fonts"] = time.perf_counter() - startTime
+
+    for step, seconds in timings.items():
+        print("[%s] -- Warm up %s: %.2f s" % (appname, step, seconds))
+    return timings
+
+
+###############################################
+#
+# tasks
+#
+###############################################
+
+# entry point of a forked task: record the start-up time it took and the
+# one it saved compared with a fresh job, then render the task. A failure
+# only ends this process, with a non-zero exit code
+def run_task(configParser, inputDate, task, days, forkTime, warmUpSeconds):
+
+    from frame_pool import init_worker
+    from render_all import products
+
+    startupSeconds = time.perf_counter() - forkTime
+    init_worker()
+    init_timings(configParser)
+    set_frame(task, inputDate)
+    emit("startup", startupSeconds)
+    emit("startup_saved", warmUpSeconds - startupSeconds)
+
+    module, productType = products[task]
+    try:
+        module.run(configParser, inputDate, days)
+    except Exception as e:
+        print("[%s] -- Task %s failed: %s" % (appname, task, e))
+        sys.exit(1)
+
+
+# fork a process per task from the warmed up zygote, running at most
+# processes of them at a time. Returns the tasks that failed
+def run_tasks(configParser, inputDate, meanSpreadDays=None, postageDays=None):
+
+    from ensemble_stats import compute_stats
+    from render_all import products, task_list
+    import map_tiles
+
+    processes = configParser.getint("zygote", "processes", fallback=4)
+    print("[%s] -- Processes set to: %s" % (appname, processes))
+    warmUpSeconds = sum(warm_up().values())
+
+    # compute the mean/std files from the members first, if requested
+    if configParser.getboolean("ensembleStats", "enabled", fallback=False):
+        compute_stats(configParser, inputDate)
+
+    context = multiprocessing.get_context("fork")
+    pending = task_list(configParser)
+    running = {}
+    failed = []
+    while pending or running:
+
+        # start the next tasks
+        while pending and len(running) < processes:
+            task = pending.pop(0)
+            days = meanSpreadDays if products[task][1] == "meanSpread" else postageDays
+            process = context.Process(target=run_task, name=task,
+                                      args=(configParser, inputDate, task, days, time.perf_counter(), warmUpSeconds))
+            process.start()
+            running[task] = process
+            print("[%s] -- Task %s forked (pid %s)" % (appname, task, process.pid))
+
+        # wait for any of them to finish
+        multiprocessing.connection.wait([process.sentinel for process in running.values()])
+        for task, process in list(running.items()):
+            if process.exitcode is not None:
+                process.join()
+                del running[task]
+                if process.exitcode != 0:
+                    failed.append(task)
+                print("[%s] -- Task %s done (exit code %s)" % (appname, task, process.exitcode))
+
+    # tile pyramids, once all the tasks are done
+    if configParser.getboolean("tiles", "enabled", fallback=False):
+        map_tiles.run(configParser, inputDate, meanSpreadDays)
+    return failed
+
+
+###############################################
+#
+# main
+#
+###############################################
+
+if __name__ == "__main__":
+
+    from time_index import parse_days
+
+    # read config file name
+    configFile = None
+    try:
+        configFile = sys.argv[1]
+    except:
+        print("[ERROR] -- Config file not provided!")
+        sys.exit(1)
+
+    # read date
+    inputDate = None
+    try:
+        inputDate = sys.argv[2]
+    except:
+        inputDate = datetime.datetime.today().strftime("%Y%m%d")
+
+    # read the days to render for the mean_spread and the postage products
+    # (a day index, a range like 1-11, or "all", the default)
+    try:
+        meanSpreadDays = parse_days(sys.argv[3] if len(sys.argv) > 3 else None)
+        postageDays = parse_days(sys.argv[4] if len(sys.argv) > 4 else None)
+    except ValueError as e:
+        print("[ERROR] -- Invalid day selection %s: %s" % (" ".join(sys.argv[3:]), e))
+        sys.exit(1)
+
+    # warm up and fork the tasks
+    configParser = configparser.ConfigParser()
+    configParser.read(configFile)
+    failed = run_tasks(configParser, inputDate, meanSpreadDays, postageDays)
+    if failed:
+        print("[%s] -- Failed tasks: %s" % (appname, ", ".join(failed)))
+    sys.exit(1 if failed else 0)